@@ -1,6 +1,10 @@
+import asyncio
 import contextlib
+import hashlib
 import json
 import logging
+import os
+import tempfile
 from collections import defaultdict
 from collections.abc import Callable, Coroutine
 from dataclasses import dataclass, field
@@ -14,9 +18,12 @@ Stamp = str
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+# the umask can only be read by setting it, so it's read once, before any threads of the build could create files
+_umask = os.umask(0)
+os.umask(_umask)
+
 
 # TODO ideas:
-# - Parallelize
 # - Serialize build logs https://apenwarr.ca/log/20181106
 
 
@@ -69,18 +76,50 @@ class Handler:
         raise NotImplementedError(f"{self} cannot build {target!r}")
 
 
-def stamp_file(target: Target) -> Stamp:
+def stamp_file(target: Target, include_ctime: bool = True) -> Stamp:
     with contextlib.suppress(OSError):
         path = Path(target)
         if path.is_file():
             s = path.stat()
             # skipped: st_nlink, st_atime_ns because they don't indicate the file's changed
             # skipped: st_ino, st_dev because they can change as removable media is remounted
-            return f"{s.st_mode} 0 0 {s.st_uid} {s.st_gid} {s.st_size} {s.st_mtime_ns} {s.st_ctime_ns}"
+            # optionally skipped: st_ctime_ns, because it also changes when the file is hardlinked
+            ctime_ns = s.st_ctime_ns if include_ctime else 0
+            return f"{s.st_mode} 0 0 {s.st_uid} {s.st_gid} {s.st_size} {s.st_mtime_ns} {ctime_ns}"
 
     return ""
 
 
+def write_if_changed(path: Path, content: str | bytes) -> bool:
+    """
+    Atomically replace the contents of the file at `path` with `content`, unless it already contains exactly that.
+
+    Unchanged files are left untouched, keeping their stamps (and mtimes) as they were.
+    Returns whether the file was written.
+    """
+    data = content.encode() if isinstance(content, str) else content
+    mode = 0o666 & ~_umask  # as `open` would create it
+    with contextlib.suppress(OSError):
+        s = path.stat()
+        mode = s.st_mode & 0o777
+        if s.st_size == len(data):
+            with open(path, "rb") as fp:
+                if hashlib.file_digest(fp, "sha256").digest() == hashlib.sha256(data).digest():
+                    return False
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+    return True
+
+
 class FileHandler(Handler):
     def can_handle(self, target: Target) -> bool:
         return True
@@ -94,6 +133,7 @@ class BuildSystem:
     db_path: Path
     handlers: list[Handler] = field(init=False, default_factory=list)
     db: BuildDB = field(init=False, default_factory=BuildDB)
+    _in_progress: dict[Target, asyncio.Future[None]] = field(init=False, default_factory=dict)
 
     def get_handler(self, target: Target) -> Handler:
         target = str(target)
@@ -128,7 +168,17 @@ class BuildSystem:
         await self.register_dependency(target, dependency)
 
     async def build(self, target: Target, level: int = 0):
+        # Targets can be built concurrently (e.g. using `asyncio.gather`).
+        # Concurrent builds of the same target share a single build.
         target = str(target)
+        in_progress = self._in_progress.get(target)
+        if in_progress is None:
+            in_progress = asyncio.ensure_future(self._build(target, level))
+            self._in_progress[target] = in_progress
+            in_progress.add_done_callback(lambda _: self._in_progress.pop(target, None))
+        await asyncio.shield(in_progress)
+
+    async def _build(self, target: Target, level: int):
         logger.info(f"{' ' * 2 * level}build({target=!r})")
         handler = self.get_handler(target)
         old_stamp = self.db.targets.get(target)
@@ -140,7 +190,7 @@ class BuildSystem:
             # upgrade weakly equal stamps to strongly equal ones
             self.db.targets[target] = cur_stamp
 
-        for dep, old_dep_stamp in self.db.dependencies[target].items():
+        for dep, old_dep_stamp in list(self.db.dependencies[target].items()):
             if dep in self.db.targets:
                 await self.build(dep, level + 1)
             dep_handler = self.get_handler(dep)
@@ -0,0 +1,22 @@
+import os
+
+from boldi import build
+from boldi.build import write_if_changed
+
+
+def test_write_if_changed_creates_files_with_the_umask(tmp_path, monkeypatch):
+    monkeypatch.setattr(build, "_umask", 0o077)
+    path = tmp_path / "page.html"
+
+    assert write_if_changed(path, "<html>")
+    assert path.stat().st_mode & 0o777 == 0o600
+
+
+def test_write_if_changed_keeps_the_mode_of_existing_files(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_text("<html>")
+    os.chmod(path, 0o640)
+
+    assert write_if_changed(path, "<html><body>")
+    assert not write_if_changed(path, "<html><body>")
+    assert path.stat().st_mode & 0o777 == 0o640
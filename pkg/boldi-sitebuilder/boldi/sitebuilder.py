@@ -1,67 +1,314 @@
+import asyncio
+import concurrent.futures
+import math
+import os
+import posixpath
 import re
+import time
 import tomllib
+import urllib.parse
 from argparse import ArgumentParser
 from collections.abc import Iterator, Mapping
-from functools import cache, partial
+from dataclasses import dataclass, field
+from functools import cached_property, partial
 from pathlib import Path
-from shutil import copytree
 from types import MappingProxyType
 from typing import IO
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, meta
 from markdown_it import MarkdownIt
 from markdown_it.token import Token
 from markdown_it.tree import SyntaxTreeNode
 from mdit_py_plugins.anchors import anchors_plugin
 from mdit_py_plugins.front_matter import front_matter_plugin
 
+from boldi.build import Builder, BuildSystem, FileHandler, Handler, Stamp, Target, write_if_changed
 from boldi.cli import CliCtx, CliUsageException, esc
 
 external_link_re = re.compile(r"^(?:[\w]+:)?//")
 
+PAGE_TEMPLATE = "index.html.j2"
+DB_SAVE_INTERVAL = 1.0
+"""The minimum seconds between saves of the build database during a build, it's saved at the end of a build too."""
+PAGE_CHUNK_SIZE = 32
+"""The maximum number of pages sent to a worker process at once, see `SiteBuilder.jobs`."""
 
-class SiteBuilder:
+
+@dataclass
+class LinkIndex:
+    """Resolves the links of pages to the pages they point to, each in O(1), built once for all pages of a site."""
+
+    source_to_target: Mapping[Path, Path]
+    """The source files of the pages and their targets, relative to the source and target folders."""
+
+    def resolve(self, page: Path, href: str) -> tuple[Path, str | None] | None:
+        """
+        Resolves a link of `page` to a Markdown file, relative to `page` (or to the site's root if it starts with `/`).
+
+        Returns the source file it points to, and the link rewritten to point to its target (keeping its query and
+        fragment, e.g. `../other.md#anchor` to `../other.html#anchor`) or `None` if there's no such page.
+        Returns `None` for other links, e.g. external ones, anchors within the page, or ones outside of the site.
+        """
+        url = urllib.parse.urlsplit(href)
+        if url.scheme or url.netloc or not url.path.endswith(".md"):
+            return None
+        path = urllib.parse.unquote(url.path)
+        linked = posixpath.normpath(path.lstrip("/") if path.startswith("/") else posixpath.join(page.parent, path))
+        if linked == ".." or linked.startswith("../"):
+            return None
+        linked_page = Path(linked)
+        if linked_page not in self.source_to_target:
+            return linked_page, None
+        return linked_page, url._replace(path=url.path.removesuffix(".md") + ".html").geturl()
+
+
+@dataclass
+class SiteHandler(Handler):
+    """Virtual `//site` target that builds all pages and static files."""
+
+    site: "SiteBuilder"
+
+    def can_handle(self, target: Target) -> bool:
+        return target == "//site"
+
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        await asyncio.gather(
+            *(builder.build(page_target) for page_target in self.site.page_targets), builder.build("//static")
+        )
+
+
+@dataclass
+class StaticHandler(Handler):
+    """Virtual `//static` target that copies all static files."""
+
+    site: "SiteBuilder"
+
+    def can_handle(self, target: Target) -> bool:
+        return target == "//static"
+
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        await asyncio.gather(*(builder.build(static_target) for static_target in self.site.static_files))
+
+
+@dataclass
+class StaticFileHandler(FileHandler):
+    site: "SiteBuilder"
+
+    def can_handle(self, target: Target) -> bool:
+        return target in self.site.static_files
+
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        source_file = self.site.static_files[target]
+        await builder.add_source(str(source_file))
+        Path(target).parent.mkdir(parents=True, exist_ok=True)
+        write_if_changed(Path(target), source_file.read_bytes())
+
+
+@dataclass
+class PageHandler(FileHandler):
+    """
+    The HTML files of pages, rebuilt when their Markdown source, the templates or the settings of the site change,
+    or when a page they link to is added or removed.
+    """
+
+    site: "SiteBuilder"
+
+    def can_handle(self, target: Target) -> bool:
+        return target in self.site.page_targets
+
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        source_file = self.site.page_targets[target]
+        await builder.add_source(str(self.site.source_dir / source_file))
+        for template_file in self.site.template_files:
+            await builder.add_source(str(template_file))
+        await builder.add_source("//settings")
+        await builder.add_source(__file__)
+        linked_pages = await self.site.write_page_async(source_file)
+        # links are rewritten depending on whether the pages exist, not on their contents
+        for linked_page in sorted(linked_pages):
+            await builder.add_source(f"//page/{linked_page.as_posix()}")
+
+
+@dataclass
+class PageExistsHandler(Handler):
+    """Virtual `//page/<source file>` sources, whose stamps tell whether a page exists."""
+
+    site: "SiteBuilder"
+
+    def can_handle(self, target: Target) -> bool:
+        return target.startswith("//page/")
+
+    def stamp(self, target: Target) -> Stamp:
+        return "exists" if Path(target.removeprefix("//page/")) in self.site.source_to_target else "missing"
+
+
+@dataclass
+class SettingsHandler(Handler):
+    """Virtual `//settings` source, whose stamp changes with the settings of the site used by pages."""
+
+    site: "SiteBuilder"
+
+    def can_handle(self, target: Target) -> bool:
+        return target == "//settings"
+
+    def stamp(self, target: Target) -> Stamp:
+        return repr({"site_name": self.site.site_name})
+
+
+@dataclass
+class SiteBuilder(BuildSystem):
+    """
+    Builds a site of the Markdown pages in `source_dir` to `target_dir`, using the templates in `source_dir/template`.
+
+    Builds are incremental (see `boldi.build`), only the pages whose sources changed are rebuilt.
+    """
+
+    db_path: Path = field(init=False)
     source_dir: Path
     target_dir: Path
     site_name: str
+    jobs: int = 1
+    """The number of worker processes rendering pages, or 1 to render them in the current process."""
+    source_to_target: Mapping[Path, Path] = field(init=False)
+    """The source files of the pages and their targets, relative to `source_dir` and `target_dir`."""
+    link_index: LinkIndex = field(init=False)
+    page_targets: dict[Target, Path] = field(init=False)
+    """The source files of the pages (relative to `source_dir`) by their targets."""
+    static_files: dict[Target, Path] = field(init=False)
+    """The source files of the static files by their targets."""
+    _db_saved: float = field(init=False, default=0.0)
+    _executor: concurrent.futures.Executor | None = field(init=False, default=None)
+    _pending_pages: list[tuple[Path, asyncio.Future[set[Path]]]] = field(init=False, default_factory=list)
 
-    def __init__(self, source_dir: Path, target_dir: Path, site_name: str):
-        assert source_dir.is_dir(), f"must be a directory: {source_dir}"
-        self.source_dir = source_dir
-        self.target_dir = target_dir
-        self.site_name = site_name
+    def __post_init__(self):
+        assert self.source_dir.is_dir(), f"must be a directory: {self.source_dir}"
+        self.db_path = self.target_dir / ".build.db.json"
         self._md = MarkdownIt("gfm-like")
         self._md = self._md.use(anchors_plugin, permalink=True, permalinkSymbol="#")
         self._md = self._md.use(front_matter_plugin)
-        self._jinja = Environment(loader=FileSystemLoader(source_dir / "template"))
+        self._jinja = Environment(loader=FileSystemLoader(self.source_dir / "template"))
+        self._source_pages = list(self.source_pages())
+        self.source_to_target = MappingProxyType(
+            {source_page: source_page.with_suffix(".html") for source_page in self._source_pages}
+        )
+        self.link_index = LinkIndex(self.source_to_target)
+        self.page_targets = {str(self.target_dir / target): source for source, target in self.source_to_target.items()}
+        static_dir = self.source_dir / "template" / "static"
+        self.static_files = {
+            str(self.target_dir / "static" / path.relative_to(static_dir)): path
+            for path in sorted(static_dir.rglob("*"))
+            if path.is_file()
+        }
+
+        self.handlers.append(SiteHandler(self))
+        self.handlers.append(StaticHandler(self))
+        self.handlers.append(StaticFileHandler(self))
+        self.handlers.append(PageHandler(self))
+        self.handlers.append(PageExistsHandler(self))
+        self.handlers.append(SettingsHandler(self))
+        self.handlers.append(FileHandler())
 
     def build_all(self) -> None:
-        for source_file in self.source_pages_list():
-            target_file = self.target_dir / self.source_to_target[source_file]
-            target_file.parent.mkdir(parents=True, exist_ok=True)
-            with target_file.open("w") as fp:
-                self.build_page(source_file, fp)
+        asyncio.run(self.build_site())
+
+    async def build_site(self):
+        self.target_dir.mkdir(parents=True, exist_ok=True)
+        await self.load_build_db()
+        if self.jobs > 1:
+            with concurrent.futures.ProcessPoolExecutor(
+                self.jobs,
+                initializer=_init_render_worker,
+                initargs=(self.source_dir, self.target_dir, self.site_name),
+            ) as executor:
+                self._executor = executor
+                try:
+                    await self.build("//site")
+                finally:
+                    self._executor = None
+        else:
+            await self.build("//site")
+        await self.save_build_db(force=True)
 
-        copytree(self.source_dir / "template" / "static", self.target_dir / "static", dirs_exist_ok=True)
+    async def save_build_db(self, force: bool = False):
+        # saved after each rebuilt target, which would take quadratic time for large sites
+        now = time.monotonic()
+        if force or now - self._db_saved >= DB_SAVE_INTERVAL:
+            self._db_saved = now
+            await super().save_build_db()
+
+    @cached_property
+    def template_files(self) -> list[Path]:
+        """The files of the page template, and of the templates it references (all of them if they're dynamic)."""
+        assert isinstance(self._jinja.loader, FileSystemLoader)
+        template_dir = Path(self._jinja.loader.searchpath[0])
+        names: set[str] = set()
+        pending = [PAGE_TEMPLATE]
+        while pending:
+            name = pending.pop()
+            if name in names:
+                continue
+            names.add(name)
+            source, _, _ = self._jinja.loader.get_source(self._jinja, name)
+            referenced = list(meta.find_referenced_templates(self._jinja.parse(source)))
+            if None in referenced:
+                return sorted(path for path in template_dir.rglob("*") if path.is_file())
+            pending.extend(name for name in referenced if name is not None)
+        return sorted(template_dir / name for name in names)
 
     def source_pages(self) -> Iterator[Path]:
-        for source_file in sorted(self.source_dir.iterdir()):
-            if source_file.is_file() and source_file.suffix == ".md":
-                yield Path(source_file.name)
+        """The Markdown files in `source_dir` and its subfolders, except for the templates and the target folder."""
+        excluded_dirs = {(self.source_dir / "template").resolve(), self.target_dir.resolve()}
+        for dirpath, dirnames, filenames in os.walk(self.source_dir):
+            dirnames[:] = sorted(
+                name
+                for name in dirnames
+                if not name.startswith(".") and Path(dirpath, name).resolve() not in excluded_dirs
+            )
+            for filename in sorted(filenames):
+                if filename.endswith(".md"):
+                    yield Path(dirpath, filename).relative_to(self.source_dir)
 
-    @cache
     def source_pages_list(self) -> list[Path]:
-        return list(self.source_pages())
+        return self._source_pages
 
-    @property
-    def source_to_target(self) -> Mapping[Path, Path]:
-        return MappingProxyType(
-            {source_page: source_page.with_suffix(".html") for source_page in self.source_pages_list()}
-        )
+    def write_page(self, source_file: Path) -> set[Path]:
+        """Renders a page to its target file, and returns the pages it links to (whether they exist or not)."""
+        html, linked_pages = self.render_page(source_file)
+        target_file = self.target_dir / self.source_to_target[source_file]
+        target_file.parent.mkdir(parents=True, exist_ok=True)
+        write_if_changed(target_file, html)
+        return linked_pages
+
+    async def write_page_async(self, source_file: Path) -> set[Path]:
+        """Like `write_page`, in a worker process if there are `jobs`, which are sent the pages in chunks."""
+        if self._executor is None:
+            return self.write_page(source_file)
+        loop = asyncio.get_running_loop()
+        if not self._pending_pages:
+            # sent once the pages of the rebuilds that started along with this one are pending too
+            loop.call_soon(self._send_pending_pages)
+        future = loop.create_future()
+        self._pending_pages.append((source_file, future))
+        return await future
+
+    def _send_pending_pages(self):
+        assert self._executor is not None
+        pending, self._pending_pages = self._pending_pages, []
+        # a few chunks per worker, so that they're kept busy until the end even if some pages take longer
+        chunk_size = min(max(math.ceil(len(pending) / (self.jobs * 4)), 1), PAGE_CHUNK_SIZE)
+        for start in range(0, len(pending), chunk_size):
+            source_files, futures = zip(*pending[start : start + chunk_size])
+            written = asyncio.wrap_future(self._executor.submit(_write_pages, list(source_files)))
+            written.add_done_callback(partial(_set_results, list(futures)))
 
     def build_page(self, source_file: Path, fp: IO):
+        html, _ = self.render_page(source_file)
+        fp.write(html)
+
+    def render_page(self, source_file: Path) -> tuple[str, set[Path]]:
+        """Renders a page, and returns its HTML and the pages it links to (whether they exist or not)."""
         assert not source_file.is_absolute(), f"must be relative: {source_file}"
-        assert source_file.is_file(), f"must be a file: {source_file}"
+        assert (self.source_dir / source_file).is_file(), f"must be a file: {source_file}"
         assert source_file.suffix == ".md", f"must be a markdown file: {source_file}"
 
         jinja_env: dict[str, object] = {}
@@ -75,6 +322,7 @@ class SiteBuilder:
                 else:
                     yield token
 
+        linked_pages = set()
         for token in walk(tokens):
             if token.type == "front_matter":
                 try:
@@ -85,9 +333,11 @@ class SiteBuilder:
                 assert isinstance(href, str)
                 if external_link_re.match(str(token.attrGet("href"))):
                     token.attrSet("target", "_blank")
-                if Path(href) in self.source_to_target:
-                    # FIXME this works for pages in the root dir but not nested pages
-                    token.attrSet("href", self.source_to_target[Path(href)].as_posix())
+                elif (link := self.link_index.resolve(source_file, href)) is not None:
+                    linked_page, target_href = link
+                    linked_pages.add(linked_page)
+                    if target_href is not None:
+                        token.attrSet("href", target_href)
 
         markdown = SyntaxTreeNode(tokens)
 
@@ -100,9 +350,34 @@ class SiteBuilder:
         title = min(headings, default=("h6", ""))
 
         html = self._md.renderer.render(tokens, self._md.options, jinja_env)
-        template = self._jinja.get_template("index.html.j2")
-        stream = template.stream(content=html, title=title[1], site_name=self.site_name)
-        stream.dump(fp)
+        template = self._jinja.get_template(PAGE_TEMPLATE)
+        return template.render(content=html, title=title[1], site_name=self.site_name), linked_pages
+
+
+_worker_site: SiteBuilder | None = None
+"""The site whose pages are rendered by a worker process, with its own Markdown parser and Jinja environment."""
+
+
+def _init_render_worker(source_dir: Path, target_dir: Path, site_name: str):
+    global _worker_site
+    _worker_site = SiteBuilder(source_dir, target_dir, site_name)
+
+
+def _write_pages(source_files: list[Path]) -> list[set[Path]]:
+    assert _worker_site is not None
+    return [_worker_site.write_page(source_file) for source_file in source_files]
+
+
+def _set_results(futures: list[asyncio.Future[set[Path]]], written: asyncio.Future[list[set[Path]]]):
+    for i, future in enumerate(futures):
+        if future.cancelled():
+            continue
+        if written.cancelled():
+            future.cancel()
+        elif (exception := written.exception()) is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(written.result()[i])
 
 
 def cli_sitebuilder(ctx: CliCtx, subparser: ArgumentParser):
@@ -110,12 +385,17 @@ def cli_sitebuilder(ctx: CliCtx, subparser: ArgumentParser):
     subparser.add_argument("--source-dir", "-s", type=Path, default=Path("."), help="source directory")
     subparser.add_argument("--target-dir", "-t", type=Path, default=Path("out"), help="target directory")
     subparser.add_argument("--site-name", "-n", type=str, default="my site", help="site name")
+    subparser.add_argument(
+        "--jobs", "-j", type=int, default=1, help="number of processes rendering pages, 0 for one per CPU (default: 1)"
+    )
     subparser.set_defaults(action=partial(cli_sitebuilder_run, ctx))
 
 
-def cli_sitebuilder_run(ctx: CliCtx, source_dir: Path, target_dir: Path, site_name: str):
+def cli_sitebuilder_run(ctx: CliCtx, source_dir: Path, target_dir: Path, site_name: str, jobs: int):
     if not source_dir.is_dir():
         raise CliUsageException(f"{esc(source_dir)} is not a directory")
+    if jobs < 0:
+        raise CliUsageException(f"--jobs must be at least 0, not {jobs}")
 
-    sitebuilder = SiteBuilder(source_dir, target_dir, site_name)
+    sitebuilder = SiteBuilder(source_dir, target_dir, site_name, jobs or os.cpu_count() or 1)
     sitebuilder.build_all()
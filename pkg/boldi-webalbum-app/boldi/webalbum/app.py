@@ -1,17 +1,621 @@
+"""
+Serves a rendered album (see `boldi.webalbum`), resizing its images on demand to the widths that weren't rendered.
+
+The album is set by its config file, whose `[app]` table configures the app (see `AppConfig`):
+
+    boldi webalbum-app run --config album.toml
+
+Several server processes (`--workers N`) share the cache of resized images, and don't resize the same image twice.
+Its metrics are served at `/metrics` for Prometheus, see `boldi.webalbum.metrics`.
+"""
+
+import asyncio
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import fcntl
+import hashlib
+import os
+import re
+import time
+import tomllib
+import uuid
 from argparse import ArgumentParser
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from email.utils import formatdate, parsedate_to_datetime
 from functools import partial
+from pathlib import Path, PurePosixPath
 
-from fastapi import FastAPI
+import pydantic
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse
+from PIL import Image
+from starlette.datastructures import Headers
 
+from boldi.build import stamp_file
 from boldi.cli import CliCtx
 
+# mypy resolves `boldi.webalbum` to the folder of its submodules instead of `webalbum.py`
+from boldi.webalbum import (  # type: ignore[attr-defined]
+    Album,
+    AlbumConfig,
+    ImageMetadata,
+    Manifest,
+    ManifestEntry,
+    TargetFolder,
+    TargetImage,
+    resize_image,
+)
+from boldi.webalbum.metrics import CONTENT_TYPE, Family, Metrics, MetricsMiddleware, exposition, request_families
+
+CONFIG_ENV = "BOLDI_WEBALBUM_CONFIG"
+"""The environment variable with the path of the album config file served by `app()`."""
+WORKERS_ENV = "WEB_CONCURRENCY"
+"""The environment variable with the number of server processes (also read by uvicorn), see `--workers`."""
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")).expanduser() / "boldi-webalbum" / "renditions"
+RENDITION_RE = re.compile(r"(?P<stem>.+)\.(?P<width>[1-9][0-9]*)(?P<suffix>\.[^.]+)")
+"""The name of a resized version of an image, e.g. `IMG_0001.800.jpg` of `IMG_0001.jpg`."""
+RENDERED_WIDTHS = (800, 1500, 3000)
+"""The widths of the resized versions rendered by the album, see `boldi.webalbum.TargetImage`."""
+IMAGE_FIELDS = frozenset({"name", "url", "renditions", *ImageMetadata.model_fields})
+"""The fields of images in the JSON API."""
+INDEX_CHECK_INTERVAL = 1.0
+"""The seconds between checks of whether the album was rendered again, and its `AlbumIndex` has to be reloaded."""
+TEMPORARY_FILE_MAX_AGE = 3600.0
+"""The seconds after which the temporary and lock files of a `RenditionCache` are deleted as left over."""
+LOCK_POLL_INTERVAL = 0.05
+"""The seconds between attempts to lock a key of a `RenditionCache` locked by another process."""
+
+
+class AppConfig(pydantic.BaseModel):
+    widths: list[int] = [400, 800, 1500, 3000]
+    """The widths images are resized to on demand, when the album doesn't have them rendered."""
+    cache_dir: Path | None = None
+    """Where images resized on demand are kept, a folder of the album's own in `CACHE_DIR` by default."""
+    cache_size: int = 1 << 30
+    """
+    The maximum total size of the images resized on demand in bytes, the least recently used ones are evicted.
+
+    With several server processes, each one keeps the images it knows of (found on start or served) within this size.
+    """
+    render_workers: int | None = None
+    """The number of processes resizing images (of each server process), the CPUs divided between them by default."""
+    max_renders: int = 64
+    """The maximum number of images being resized or waiting for a process, more requests are answered with 503."""
+
+    def model_post_init(self, context: object, /) -> None:
+        self.cache_dir = self.cache_dir.expanduser() if self.cache_dir else None
+
+
+def load_config(config_path: Path) -> tuple[AlbumConfig, AppConfig]:
+    """Loads an album config file, and the `[app]` table in it."""
+    with open(config_path, "rb") as config_file:
+        config_dict = tomllib.load(config_file)
+    app_config = AppConfig(**config_dict.pop("app", {}))
+    album_config = AlbumConfig(**config_dict)
+    if app_config.cache_dir is None:
+        album_id = hashlib.sha256(str(album_config.target.resolve()).encode()).hexdigest()[:16]
+        app_config.cache_dir = CACHE_DIR / f"{album_config.target.name}-{album_id}"
+    return album_config, app_config
+
+
+@dataclass
+class RenditionCache:
+    """
+    A size-bounded disk cache of files, which evicts the least recently used ones.
+
+    Files are used by their relative paths (keys). Their recency is their mtime, touched when used,
+    so it's kept across restarts.
+
+    The cache can be shared by processes (see `--workers`): each one evicts from the files it knows of, finds the files
+    added by the others when they're used, and `lock`s the keys it writes.
+    """
+
+    root: Path
+    max_size: int
+    entries: collections.OrderedDict[PurePosixPath, tuple[int, int]] = field(
+        init=False, default_factory=collections.OrderedDict
+    )
+    """The sizes and mtimes (in ns) of the cached files, the least recently used first."""
+    size: int = field(init=False, default=0)
+    hits: int = field(init=False, default=0)
+    misses: int = field(init=False, default=0)
+    evictions: int = field(init=False, default=0)
+
+    def __post_init__(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        files = []
+        stale = time.time_ns() - int(TEMPORARY_FILE_MAX_AGE * 1e9)
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = Path(dirpath, filename)
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:  # removed by another process
+                    continue
+                if not filename.startswith("."):
+                    files.append((stat.st_mtime_ns, PurePosixPath(path.relative_to(self.root)), stat.st_size))
+                elif stat.st_mtime_ns < stale:  # left over by an interrupted `add` or `lock`, newer ones may be in use
+                    path.unlink(missing_ok=True)
+        for mtime_ns, key, size in sorted(files):
+            self._set(key, size, mtime_ns)
+        self.evict()
+
+    def get(self, key: PurePosixPath) -> Path | None:
+        """The path of the cached file, or `None` if it isn't cached."""
+        path = self.touch(key)
+        if path is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return path
+
+    def touch(self, key: PurePosixPath) -> Path | None:
+        """Like `get`, without counting it as a hit or a miss."""
+        path = self.root / key
+        now = time.time_ns()
+        try:
+            os.utime(path, ns=(now, now))
+            size = self.entries[key][0] if key in self.entries else path.stat().st_size  # added by another process
+        except FileNotFoundError:  # deleted behind the cache's back, e.g. evicted by another process
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[0]
+            return None
+        self._set(key, size, now)
+        return path
+
+    def temporary_path(self, key: PurePosixPath) -> Path:
+        """A unique path to write a file to, before it's added to the cache with `add`."""
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path.with_name(f".{uuid.uuid4().hex}.{path.name}")
+
+    def add(self, key: PurePosixPath, temporary_path: Path) -> Path:
+        """Moves a file written to `temporary_path` into the cache, and returns its path."""
+        path = self.root / key
+        stat = temporary_path.stat()
+        os.replace(temporary_path, path)
+        self._set(key, stat.st_size, stat.st_mtime_ns)
+        self.evict()
+        return path
+
+    @contextlib.asynccontextmanager
+    async def lock(self, key: PurePosixPath) -> AsyncIterator[None]:
+        """Holds an exclusive lock of a key across the processes sharing the cache, e.g. while its file is written."""
+        path = self.root / key
+        path = path.with_name(f".{path.name}.lock")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            locked = False
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                # lock files are deleted when unlocked, and locking a deleted one wouldn't keep others from locking
+                locked = os.path.samestat(os.fstat(fd), os.stat(path))
+            except (BlockingIOError, FileNotFoundError):
+                pass
+            finally:
+                if not locked:
+                    os.close(fd)
+            if locked:
+                break
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            path.unlink(missing_ok=True)
+            os.close(fd)
+
+    def evict(self):
+        # the most recently used file is kept even if it's larger than the cache
+        while self.size > self.max_size and len(self.entries) > 1:
+            key, (size, mtime_ns) = self.entries.popitem(last=False)
+            self.size -= size
+            path = self.root / key
+            try:
+                if (used_ns := path.stat().st_mtime_ns) > mtime_ns:  # used by another process since
+                    self._set(key, size, used_ns)
+                    continue
+                path.unlink()
+            except FileNotFoundError:  # evicted by another process
+                continue
+            self.evictions += 1
+
+    def _set(self, key: PurePosixPath, size: int, mtime_ns: int):
+        """Records a file as the most recently used one."""
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[0]
+        self.entries[key] = (size, mtime_ns)
+        self.size += size
+
+
+class RenderQueueFull(Exception):
+    """Raised when an image would be resized on demand, but `AppConfig.max_renders` images are being resized."""
+
+
+@dataclass(frozen=True)
+class AlbumFile:
+    """A file served by the app, with the validators of its contents for conditional requests."""
+
+    path: Path
+    etag: str
+    """A strong entity tag, which only changes when the contents of the file change."""
+    last_modified: float
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return {"etag": self.etag, "last-modified": formatdate(self.last_modified, usegmt=True)}
+
+    def is_not_modified(self, request_headers: Headers) -> bool:
+        """Whether a conditional request can be answered with 304 Not Modified (see RFC 9110, section 13.1)."""
+        if (if_none_match := request_headers.get("if-none-match")) is not None:
+            # weak comparison, as required for If-None-Match
+            etags = [etag.strip().removeprefix("W/") for etag in if_none_match.split(",")]
+            return "*" in etags or self.etag in etags
+        if (if_modified_since := request_headers.get("if-modified-since")) is not None:
+            try:
+                return int(self.last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):  # invalid dates are ignored
+                return False
+        return False
+
+
+def stamp_etag(stamp: str) -> str:
+    return f'"{hashlib.sha256(stamp.encode()).hexdigest()[:32]}"'
+
+
+def manifest_stamp(album: Album) -> str:
+    """The stamp of the album's manifest, which is written at the end of each render of the album."""
+    return stamp_file(str(album.manifest_path), include_ctime=False)
+
+
+@dataclass
+class FolderIndex:
+    """The images of a folder, in the form of the JSON API."""
+
+    folder: TargetFolder
+    images: list[dict[str, object]] = field(default_factory=list)
+    positions: dict[str, int] = field(default_factory=dict)
+    """The position after each image in `images` by name, where the page after it starts."""
+
+
+@dataclass
+class AlbumIndex:
+    """
+    The folders and images of a rendered album, loaded once (see `load`) and replaced when the album is rendered again.
+
+    The album's folders are scanned, and the metadata of its images is read from the album's files.
+    """
+
+    album: Album
+    stamp: str
+    """The `manifest_stamp` of the album when it was loaded."""
+    widths: list[int]
+    """The widths of the resized versions of images listed by the JSON API."""
+    images: dict[Path, TargetImage] = field(init=False, default_factory=dict)
+    folders: dict[PurePosixPath, FolderIndex] = field(init=False, default_factory=dict)
+    hidden_paths: set[Path] = field(init=False)
+    manifest: dict[str, ManifestEntry] = field(init=False, default_factory=dict)
+    """The digests of the album's files, see `boldi.webalbum.ManifestHandler`."""
+
+    @classmethod
+    def load(cls, album_config: AlbumConfig, widths: list[int]) -> "AlbumIndex":
+        album = Album(album_config.target / "build.db.json", album_config)
+        return cls(album, manifest_stamp(album), sorted({*RENDERED_WIDTHS, *widths}))
+
+    def __post_init__(self):
+        self.hidden_paths = set(self.album.internal_paths)
+        with contextlib.suppress(OSError, ValueError):
+            self.manifest = Manifest.validate_json(self.album.manifest_path.read_bytes())
+        for folder in self.album.target_root.all_folders():
+            folder_index = self.folders[self.relative_path(folder.path)] = FolderIndex(folder)
+            for name, image in folder.images.items():
+                self.images[image.path] = image
+                try:
+                    image_json = self.image_json(image)
+                except OSError:  # not rendered yet
+                    continue
+                folder_index.images.append(image_json)
+                folder_index.positions[name] = len(folder_index.images)
+
+    def relative_path(self, path: Path) -> PurePosixPath:
+        return PurePosixPath(path.relative_to(self.album.target_root.path).as_posix())
+
+    def image_json(self, image: TargetImage) -> dict[str, object]:
+        path = self.relative_path(image.path)
+        return {
+            "name": path.name,
+            "url": f"/{path}",
+            "renditions": {
+                str(width): f"/{path.with_name(f'{path.stem}.{width}{path.suffix}')}" for width in self.widths
+            },
+            **image.metadata.model_dump(mode="json"),
+        }
+
+    def folder_json(self, folder: TargetFolder, depth: int) -> dict[str, object]:
+        path = self.relative_path(folder.path)
+        folder_json: dict[str, object] = {
+            "path": path.as_posix() if path.parts else "",
+            "url": f"/{path}/" if path.parts else "/",
+            "title": folder.title,
+            "image_count": len(folder.images),
+            "total_image_count": folder.total_image_count,
+            "cover": None,
+        }
+        with contextlib.suppress(OSError):  # not rendered yet
+            folder_json["cover"] = self.image_json(folder.cover_image)
+        if depth > 0:
+            folder_json["subfolders"] = [
+                self.folder_json(subfolder, depth - 1) for subfolder in folder.subfolders.values()
+            ]
+        return folder_json
+
+
+def select_fields(item: dict[str, object], fields: set[str] | None) -> dict[str, object]:
+    return item if fields is None else {key: value for key, value in item.items() if key in fields}
+
+
+def encode_cursor(position: int, name: str) -> str:
+    return base64.urlsafe_b64encode(f"{position}:{name}".encode()).decode()
+
+
+def decode_cursor(cursor: str, positions: dict[str, int]) -> int:
+    """The position to continue from after the image of the cursor, or at its position if it was removed since."""
+    try:
+        position, name = base64.urlsafe_b64decode(cursor.encode()).decode().split(":", 1)
+        return positions.get(name, max(int(position), 0))
+    except ValueError:  # also invalid base64 and UTF-8
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
+@dataclass
+class AlbumServer:
+    """Resolves the URL paths of an album to the files served, resizing images on demand."""
+
+    album_config: AlbumConfig
+    config: AppConfig
+    cache: RenditionCache
+    index: AlbumIndex
+    executor: concurrent.futures.Executor | None = None
+    metrics: Metrics = field(default_factory=Metrics)
+    _renders: dict[PurePosixPath, asyncio.Future[Path]] = field(init=False, default_factory=dict)
+    _rendering: int = field(init=False, default=0)
+    """The number of `_renders` submitted to the `executor`, the others wait for another server process."""
+    _index_checked: float = field(init=False, default_factory=time.monotonic)
+    _index_reload: asyncio.Future[AlbumIndex] | None = field(init=False, default=None)
+
+    @classmethod
+    def from_config(cls, album_config: AlbumConfig, config: AppConfig) -> "AlbumServer":
+        assert config.cache_dir is not None
+        cache = RenditionCache(config.cache_dir, config.cache_size)
+        return cls(album_config, config, cache, AlbumIndex.load(album_config, config.widths))
+
+    @property
+    def album(self) -> Album:
+        return self.index.album
+
+    @property
+    def render_workers(self) -> int:
+        return self.config.render_workers or max((os.cpu_count() or 1) // int(os.environ.get(WORKERS_ENV, "1")), 1)
+
+    def check_index(self):
+        """Reloads the index in the background if the album was rendered again, the current one is used meanwhile."""
+        now = time.monotonic()
+        if self._index_reload is not None or now - self._index_checked < INDEX_CHECK_INTERVAL:
+            return
+        self._index_checked = now
+        if manifest_stamp(self.album) == self.index.stamp:
+            return
+        reload = asyncio.ensure_future(asyncio.to_thread(AlbumIndex.load, self.album_config, self.config.widths))
+        self._index_reload = reload
+
+        def reloaded(_: asyncio.Future[AlbumIndex]):
+            self._index_reload = None
+            if not reload.cancelled() and reload.exception() is None:
+                self.index = reload.result()
+
+        reload.add_done_callback(reloaded)
+
+    async def file(self, url_path: str) -> AlbumFile | None:
+        """The file at a URL path of the album, `index.html` for folders, or `None` if there isn't one."""
+        relative_path = PurePosixPath(url_path.strip("/"))
+        if any(part.startswith(".") for part in relative_path.parts):  # also `..`
+            return None
+        path = self.album.target_root.path / relative_path
+        if path.is_dir():
+            path /= "index.html"
+            relative_path /= "index.html"
+        if path.is_file():
+            return None if path in self.index.hidden_paths else self.album_file(path, relative_path)
+        return await self.rendition(path)
+
+    def album_file(self, path: Path, relative_path: PurePosixPath) -> AlbumFile:
+        stamp = stamp_file(str(path), include_ctime=False)
+        entry = self.index.manifest.get(relative_path.as_posix())
+        # the digest of the contents if the manifest is up to date, the stamp of the file itself otherwise
+        etag = f'"{entry.sha256[:32]}"' if entry and entry.stamp == stamp else stamp_etag(stamp)
+        return AlbumFile(path, etag, path.stat().st_mtime)
+
+    async def rendition(self, path: Path) -> AlbumFile | None:
+        """The resized version of an image at `path`, resized on demand, or `None` if it isn't one."""
+        match = RENDITION_RE.fullmatch(path.name)
+        if match is None or int(match["width"]) not in self.config.widths:
+            return None
+        image = self.index.images.get(path.with_name(match["stem"] + match["suffix"]))
+        if image is None:
+            return None
+
+        # a changed source image is cached with another key, the old one is evicted eventually
+        stamp = stamp_file(str(image.source.path), include_ctime=False)
+        version = hashlib.sha256(stamp.encode()).hexdigest()[:16]
+        relative_path = path.relative_to(self.album.target_root.path)
+        key = PurePosixPath(relative_path.parent.as_posix(), f"{path.stem}.{version}{path.suffix}")
+        # the mtime of cached files is their recency, so their validators are the source's
+        etag, last_modified = stamp_etag(key.as_posix()), image.source.path.stat().st_mtime
+        if (cached_path := self.cache.get(key)) is not None:
+            return AlbumFile(cached_path, etag, last_modified)
+
+        # concurrent requests of the same image share a single render, which isn't cancelled with any of them
+        render = self._renders.get(key)
+        if render is None:
+            if len(self._renders) >= self.config.max_renders:
+                raise RenderQueueFull()
+            render = asyncio.ensure_future(self._render(key, image, int(match["width"])))
+            self._renders[key] = render
+            render.add_done_callback(lambda _: self._renders.pop(key, None))
+        return AlbumFile(await asyncio.shield(render), etag, last_modified)
+
+    async def _render(self, key: PurePosixPath, image: TargetImage, width: int) -> Path:
+        # other server processes sharing the cache wait for this render instead of rendering the same image
+        async with self.cache.lock(key):
+            if (cached_path := self.cache.touch(key)) is not None:  # rendered by another one while waiting
+                return cached_path
+            temporary_path = self.cache.temporary_path(key)
+            self._rendering += 1
+            try:
+                seconds = await asyncio.get_running_loop().run_in_executor(
+                    self.executor,
+                    timed_resize_image,
+                    image.source.path,
+                    {width: temporary_path},
+                    self.album_config.max_image_pixels,
+                )
+                self.metrics.renders.observe(seconds)
+                return self.cache.add(key, temporary_path)
+            finally:
+                self._rendering -= 1
+                temporary_path.unlink(missing_ok=True)
+
+    def metric_families(self) -> list[Family]:
+        """The metrics of the server, the recorded ones and the current state of its cache and renders."""
+        busy_workers = min(self._rendering, self.render_workers)
+        return [
+            *request_families(self.metrics),
+            Family.single(
+                "rendition_cache_hits_total", "counter", "Resized images served from the cache.", self.cache.hits
+            ),
+            Family.single(
+                "rendition_cache_misses_total", "counter", "Resized images not in the cache.", self.cache.misses
+            ),
+            Family.single(
+                "rendition_cache_evictions_total",
+                "counter",
+                "Resized images evicted from the cache.",
+                self.cache.evictions,
+            ),
+            Family.single("rendition_cache_entries", "gauge", "Resized images in the cache.", len(self.cache.entries)),
+            Family.single(
+                "rendition_cache_bytes", "gauge", "Size of the resized images in the cache.", self.cache.size
+            ),
+            Family.single(
+                "rendition_cache_max_bytes", "gauge", "Size the cache is evicted down to.", self.cache.max_size
+            ),
+            Family.single(
+                "renders_in_flight", "gauge", "Images being resized or waiting for a worker.", len(self._renders)
+            ),
+            Family.single(
+                "render_queue_depth",
+                "gauge",
+                "Images waiting for a render worker, or another server process.",
+                len(self._renders) - busy_workers,
+            ),
+            Family.single(
+                "render_queue_max_depth", "gauge", "Renders in flight before answering 503.", self.config.max_renders
+            ),
+            Family.single("render_workers", "gauge", "Processes of the render pool.", self.render_workers),
+            Family.single(
+                "render_workers_busy", "gauge", "Processes of the render pool resizing an image.", busy_workers
+            ),
+        ]
+
+
+def timed_resize_image(*args) -> float:
+    """Runs `resize_image` (in a render worker), and returns the seconds it took."""
+    start = time.perf_counter()
+    resize_image(*args)
+    return time.perf_counter() - start
+
+
+def app(config_path: Path | None = None) -> FastAPI:
+    """Creates the app serving the album of `config_path`, or of the `CONFIG_ENV` environment variable."""
+    if config_path is None:
+        if CONFIG_ENV not in os.environ:
+            raise RuntimeError(f"set {CONFIG_ENV} to the album config file to serve")
+        config_path = Path(os.environ[CONFIG_ENV])
+    album_config, app_config = load_config(config_path)
+    server = AlbumServer.from_config(album_config, app_config)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(_: FastAPI):
+        with concurrent.futures.ProcessPoolExecutor(server.render_workers) as executor:
+            server.executor = executor
+            # the index is loaded by `app()` already, the render workers are started before serving too
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(executor, Image.init) for _ in range(server.render_workers)))
+            yield
+
+    fastapi_app = FastAPI(title=f"boldi webalbum app: {album_config.title}", lifespan=lifespan)
+    fastapi_app.state.server = server
+    fastapi_app.add_middleware(MetricsMiddleware, metrics=server.metrics)
+
+    def folder_index(path: str) -> FolderIndex:
+        server.check_index()
+        folder_index = server.index.folders.get(PurePosixPath(path.strip("/")))
+        if folder_index is None:
+            raise HTTPException(status_code=404, detail="no such folder")
+        return folder_index
+
+    def parse_fields(fields: str | None, known_fields: frozenset[str]) -> set[str] | None:
+        if fields is None:
+            return None
+        selected = set(filter(None, fields.split(",")))
+        if unknown := selected - known_fields:
+            raise HTTPException(status_code=400, detail=f"unknown fields: {', '.join(sorted(unknown))}")
+        return selected
+
+    @fastapi_app.get("/api/folders/{path:path}")
+    async def api_folder(path: str, depth: int = Query(1, ge=0, le=10)) -> dict[str, object]:
+        """A folder of the album (`""` for the album itself), with its subfolders up to `depth` levels."""
+        return server.index.folder_json(folder_index(path).folder, depth)
+
+    @fastapi_app.get("/api/images/{path:path}")
+    async def api_images(
+        path: str,
+        cursor: str | None = None,
+        limit: int = Query(100, ge=1, le=1000),
+        fields: str | None = Query(None, description=f"comma-separated, of: {', '.join(sorted(IMAGE_FIELDS))}"),
+    ) -> dict[str, object]:
+        """A page of the images of a folder, the next page starts at the returned `cursor` (`null` after the last)."""
+        index = folder_index(path)
+        selected_fields = parse_fields(fields, IMAGE_FIELDS)
+        start = decode_cursor(cursor, index.positions) if cursor else 0
+        page = index.images[start : start + limit]
+        end = start + len(page)
+        return {
+            "images": [select_fields(image, selected_fields) for image in page],
+            "cursor": encode_cursor(end, str(page[-1]["name"])) if page and end < len(index.images) else None,
+        }
 
-def app():
-    fastapi_app = FastAPI(title="boldi webalbum app")
+    @fastapi_app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics() -> Response:
+        """The metrics of the app in the Prometheus text format, see `boldi.webalbum.metrics`."""
+        return Response(exposition(server.metric_families(), {"pid": str(os.getpid())}), media_type=CONTENT_TYPE)
 
-    @fastapi_app.get("/")
-    def index():
-        return {"message": "Hello, World!"}
+    @fastapi_app.api_route("/{url_path:path}", methods=["GET", "HEAD"])
+    async def album_file(url_path: str, request: Request) -> Response:
+        server.check_index()
+        try:
+            file = await server.file(url_path)
+        except RenderQueueFull:
+            raise HTTPException(status_code=503, detail="too many images being resized", headers={"Retry-After": "1"})
+        if file is None:
+            raise HTTPException(status_code=404)
+        if file.is_not_modified(request.headers):
+            return Response(status_code=304, headers=file.headers)
+        # also answers range requests, and is sent with the server's zero-copy `pathsend` extension if it has one
+        return FileResponse(file.path, headers=file.headers)
 
     return fastapi_app
 
@@ -22,8 +626,17 @@ def cli_webalbum_app(ctx: CliCtx, subparser: ArgumentParser):
 
     subparser_run = webalbum_app_subparsers.add_parser("run")
     subparser_run.set_defaults(action=partial(cli_webalbum_app_run, ctx))
+    subparser_run.add_argument("--config", type=Path, help=f"album config file (default: ${CONFIG_ENV})")
+    subparser_run.add_argument(
+        "--workers", type=int, help=f"number of server processes, sharing the rendition cache (default: ${WORKERS_ENV})"
+    )
     subparser_run.add_argument("args", nargs="*", default=[], help="uvicorn arguments")
 
 
-def cli_webalbum_app_run(ctx: CliCtx, args: list[str]):
+def cli_webalbum_app_run(ctx: CliCtx, config: Path | None, workers: int | None, args: list[str]):
+    if config:
+        ctx.env[CONFIG_ENV] = str(config.resolve())
+    if workers:
+        # read by uvicorn for its number of workers, and by the app to divide the CPUs between their render workers
+        ctx.env[WORKERS_ENV] = str(workers)
     ctx.run("uvicorn --factory", args, f"{__name__}:app")
@@ -0,0 +1,250 @@
+"""
+Load test of the webalbum app, against a synthetic album generated with Pillow and rendered with `boldi.webalbum`.
+
+Starts the app in-process, and drives a mixed workload of concurrent requests (see `WORKLOAD`) against it over HTTP:
+
+    python -m boldi.webalbum.loadtest --folders 10 --images 100 --requests 10000 --concurrency 32
+
+Needs the `loadtest` extra. The album is kept in `--root` (a temporary folder by default) to reuse it in later runs.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import random
+import socket
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import httpx
+import uvicorn
+from PIL import Image
+
+# mypy resolves `boldi.webalbum` to the folder of its submodules instead of `webalbum.py`
+from boldi.webalbum import Album, AlbumConfig  # type: ignore[attr-defined]
+from boldi.webalbum.app import AlbumServer, app, load_config
+
+WORKLOAD = {"page": 2, "thumbnail": 5, "original": 1, "api": 2}
+"""The default relative frequencies of the kinds of requests, see `--mix`."""
+
+
+def generate_album(root: Path, folders: int, images: int, image_size: tuple[int, int], seed: int):
+    """Generates the source images of an album with `folders` folders of `images` images in `root`."""
+    rng = random.Random(seed)
+    for folder in range(folders):
+        folder_path = root / f"Folder {folder:03}"
+        folder_path.mkdir(parents=True, exist_ok=True)
+        for image in range(images):
+            image_path = folder_path / f"IMG_{image:05}.jpg"
+            if image_path.exists():
+                continue
+            width, height = image_size if rng.random() < 0.7 else image_size[::-1]
+            # noise makes the files about as large as photos, which compress far worse than flat colours
+            noise = Image.effect_noise((width // 4, height // 4), 64).resize((width, height))
+            color = Image.new("RGB", (width, height), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+            with Image.blend(color, noise.convert("RGB"), 0.3) as pil_image:
+                exif = pil_image.getexif()
+                exif[0x010F] = "BOLDI"  # Make
+                exif[0x0110] = "Load Test"  # Model
+                exif.get_ifd(0x8769)[0x9003] = f"2024:{folder % 12 + 1:02}:01 12:00:00"  # DateTimeOriginal
+                pil_image.save(image_path, quality=90, exif=exif)
+
+
+async def render_album(album_config: AlbumConfig):
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        album = Album(album_config.target / "build.db.json", album_config, executor)
+        await album.init()
+        await album.render()
+
+
+@dataclass
+class Urls:
+    """The URLs of the album requested by each kind of request."""
+
+    pages: list[str] = field(default_factory=list)
+    thumbnails: list[str] = field(default_factory=list)
+    originals: list[str] = field(default_factory=list)
+    api: list[str] = field(default_factory=list)
+
+    @classmethod
+    async def discover(cls, client: httpx.AsyncClient) -> "Urls":
+        urls = cls()
+        folders: list[dict[str, Any]] = [{"path": "", "subfolders": None}]
+        while folders:
+            folder = folders.pop()
+            if folder.get("subfolders") is None:  # deeper than the depth of the request
+                response = await client.get(f"/api/folders/{folder['path']}", params={"depth": 10})
+                response.raise_for_status()
+                folder = response.json()
+            folders.extend(folder["subfolders"])
+            urls.pages.append(folder["url"])
+            urls.api.append(f"/api/folders/{folder['path']}")
+            cursor = None
+            while True:
+                params: dict[str, str | int] = {"limit": 1000, "fields": "url,renditions"}
+                if cursor:
+                    params["cursor"] = cursor
+                response = await client.get(f"/api/images/{folder['path']}", params=params)
+                response.raise_for_status()
+                page = response.json()
+                for image in page["images"]:
+                    urls.originals.append(image["url"])
+                    # the smaller versions, as loaded by folder pages
+                    urls.thumbnails.extend(url for width, url in image["renditions"].items() if int(width) <= 800)
+                if page["images"]:
+                    urls.api.append(f"/api/images/{folder['path']}?limit=100")
+                cursor = page["cursor"]
+                if cursor is None:
+                    break
+        return urls
+
+    def of_kind(self, kind: str) -> list[str]:
+        return {"page": self.pages, "thumbnail": self.thumbnails, "original": self.originals, "api": self.api}[kind]
+
+
+@dataclass
+class Results:
+    latencies: defaultdict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    """The seconds each request took, by kind."""
+    statuses: defaultdict[str, defaultdict[int, int]] = field(
+        default_factory=lambda: defaultdict(lambda: defaultdict(int))
+    )
+    errors: int = 0
+    """Requests that failed without a response."""
+    duration: float = 0.0
+
+    def report(self, server: AlbumServer, print: Callable[[str], None] = print):
+        def line(name: str, latencies: list[float]):
+            # `quantiles` needs at least two data points
+            p = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+            print(
+                f"{name:<10} {len(latencies):>8} {len(latencies) / self.duration:>9.1f}"
+                f" {p[49] * 1000:>9.1f} {p[94] * 1000:>9.1f} {p[98] * 1000:>9.1f}"
+            )
+
+        print(f"{'kind':<10} {'requests':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for kind, latencies in sorted(self.latencies.items()):
+            line(kind, latencies)
+        line("total", [latency for latencies in self.latencies.values() for latency in latencies])
+        for kind, statuses in sorted(self.statuses.items()):
+            print(f"{kind} statuses: " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items())))
+        if self.errors:
+            print(f"errors: {self.errors}")
+        cache = server.cache
+        lookups = cache.hits + cache.misses
+        print(
+            f"rendition cache: {cache.hits} hits, {cache.misses} misses"
+            f" ({cache.hits / lookups if lookups else 0:.1%} hit rate), {cache.evictions} evictions"
+        )
+
+
+async def run_clients(
+    client: httpx.AsyncClient, urls: Urls, mix: dict[str, float], requests: int, concurrency: int, seed: int
+) -> Results:
+    rng = random.Random(seed)
+    kinds = [kind for kind in mix if urls.of_kind(kind)]
+    weights = [mix[kind] for kind in kinds]
+    # drawn up front, so that the workload is the same in each run
+    workload = [(kind, rng.choice(urls.of_kind(kind))) for kind in rng.choices(kinds, weights, k=requests)]
+    results = Results()
+
+    async def client_loop():
+        while workload:
+            kind, url = workload.pop()
+            start = time.perf_counter()
+            try:
+                response = await client.get(url)
+            except httpx.HTTPError:
+                results.errors += 1
+                continue
+            results.latencies[kind].append(time.perf_counter() - start)
+            results.statuses[kind][response.status_code] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    results.duration = time.perf_counter() - start
+    return results
+
+
+async def load_test(args: argparse.Namespace):
+    root = args.root or Path(tempfile.mkdtemp(prefix="boldi-webalbum-loadtest-"))
+    print(f"album: {root}")
+    generate_album(root / "source", args.folders, args.images, args.image_size, args.seed)
+    config_path = root / "album.toml"
+    config_path.write_text(
+        "\n".join(
+            [
+                'title = "Load test"',
+                'copyright = "boldi"',
+                f'source = "{root / "source"}"',
+                f'target = "{root / "album"}"',
+                "[app]",
+                f'cache_dir = "{root / "cache"}"',
+                f"cache_size = {args.cache_size}",
+            ]
+        )
+    )
+    print("rendering the album")
+    await render_album(load_config(config_path)[0])
+    fastapi_app = app(config_path)
+    server: AlbumServer = fastapi_app.state.server
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    uvicorn_server = uvicorn.Server(uvicorn.Config(fastapi_app, port=port, log_level="warning"))
+    serving = asyncio.create_task(uvicorn_server.serve())
+    try:
+        while not uvicorn_server.started:
+            await asyncio.sleep(0.01)
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+            urls = await Urls.discover(client)
+            print(f"{args.requests} requests by {args.concurrency} clients")
+            results = await run_clients(client, urls, args.mix, args.requests, args.concurrency, args.seed)
+    finally:
+        uvicorn_server.should_exit = True
+        await serving
+    results.report(server)
+
+
+def parse_size(size: str) -> tuple[int, int]:
+    width, height = size.split("x")
+    return int(width), int(height)
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    parsed = {kind: float(weight) for kind, weight in (item.split("=") for item in mix.split(","))}
+    if unknown := parsed.keys() - WORKLOAD.keys():
+        raise argparse.ArgumentTypeError(f"unknown kinds of requests: {', '.join(sorted(unknown))}")
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", type=Path, help="folder of the album, reused if it exists (default: temporary)")
+    parser.add_argument("--folders", type=int, default=10, help="number of folders of the album")
+    parser.add_argument("--images", type=int, default=50, help="number of images per folder")
+    parser.add_argument("--image-size", type=parse_size, default=(2400, 1600), help="size of the images, WxH")
+    parser.add_argument("--requests", "-n", type=int, default=5000, help="total number of requests")
+    parser.add_argument("--concurrency", "-c", type=int, default=32, help="number of concurrent clients")
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=WORKLOAD,
+        help="relative frequencies of the kinds of requests (default: %(default)s)",
+    )
+    parser.add_argument("--cache-size", type=int, default=1 << 30, help="size of the rendition cache in bytes")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the album and the workload")
+    args = parser.parse_args()
+    asyncio.run(load_test(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Metrics of the webalbum app, served in the Prometheus text format (see `boldi.webalbum.app`) without a client library.
+
+`MetricsMiddleware` records the requests, the app records its renders, and the rest (e.g. of the rendition cache) is
+read when scraped.
+
+Each server process (see `--workers`) records and serves its own metrics, so their samples are labelled with the `pid`
+of the process: a scrape may reach any of them, and their counters are summed over `pid` in queries.
+"""
+
+import bisect
+import collections
+import math
+import time
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass, field
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+PREFIX = "boldi_webalbum_"
+"""The prefix of the names of all metrics."""
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""The upper bounds (in seconds) of the buckets of latency histograms."""
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+"""The content type of the Prometheus text format."""
+
+Labels = Mapping[str, str]
+
+
+@dataclass
+class Histogram:
+    buckets: tuple[float, ...] = LATENCY_BUCKETS
+    counts: list[int] = field(init=False)
+    """The number of observations in each bucket, and above the last one (not cumulative)."""
+    sum: float = 0.0
+
+    def __post_init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, labels: Labels) -> Iterable[tuple[str, Labels, float]]:
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), self.counts):
+            cumulative += count
+            yield "_bucket", {**labels, "le": format_value(bound)}, cumulative
+        yield "_sum", labels, self.sum
+        yield "_count", labels, cumulative
+
+
+@dataclass
+class Metrics:
+    """The metrics recorded as they happen, as opposed to the ones read when scraped."""
+
+    requests: collections.defaultdict[tuple[str, str], Histogram] = field(
+        default_factory=lambda: collections.defaultdict(Histogram)
+    )
+    """The latency of requests by method and route (the path pattern they matched)."""
+    responses: collections.Counter[tuple[str, str, int]] = field(default_factory=collections.Counter)
+    """The number of responses by method, route and status."""
+    in_flight: int = 0
+    renders: Histogram = field(default_factory=Histogram)
+    """The seconds render workers spent on each render, excluding the time it was queued."""
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        self.requests[method, route].observe(seconds)
+        self.responses[method, route, status] += 1
+
+
+class MetricsMiddleware:
+    """Records the latency and status of HTTP requests, and the number of them in flight, in `metrics`."""
+
+    def __init__(self, app: ASGIApp, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500  # if the app fails before responding
+
+        async def send_and_record_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        finally:
+            self.metrics.in_flight -= 1
+            # set by the router, on the same scope; paths are not labels, there would be one per image
+            route = getattr(scope.get("route"), "path", "<unmatched>")
+            self.metrics.observe_request(scope["method"], route, status, time.perf_counter() - start)
+
+
+@dataclass
+class Family:
+    """A metric and its samples, e.g. the buckets, sum and count of a histogram, with their name suffix and labels."""
+
+    name: str
+    type: str
+    help: str
+    samples: list[tuple[str, Labels, float]] = field(default_factory=list)
+
+    @classmethod
+    def single(cls, name: str, type: str, help: str, value: float) -> "Family":
+        return cls(name, type, help, [("", {}, value)])
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def exposition(families: Iterable[Family], labels: Labels) -> str:
+    """The families of metrics in the Prometheus text format, with `labels` added to all their samples."""
+    lines = []
+    for family in families:
+        lines.append(f"# HELP {PREFIX}{family.name} {family.help}")
+        lines.append(f"# TYPE {PREFIX}{family.name} {family.type}")
+        lines.extend(
+            f"{PREFIX}{family.name}{suffix}{format_labels({**labels, **sample_labels})} {format_value(value)}"
+            for suffix, sample_labels, value in family.samples
+        )
+    return "\n".join(lines) + "\n"
+
+
+def request_families(metrics: Metrics) -> list[Family]:
+    requests = Family("http_request_duration_seconds", "histogram", "Latency of HTTP requests, by route.")
+    for (method, route), histogram in sorted(metrics.requests.items()):
+        requests.samples.extend(histogram.samples({"method": method, "route": route}))
+    responses = Family("http_responses_total", "counter", "HTTP responses, by route and status.")
+    responses.samples.extend(
+        ("", {"method": method, "route": route, "status": str(status)}, count)
+        for (method, route, status), count in sorted(metrics.responses.items())
+    )
+    return [
+        requests,
+        responses,
+        Family.single("http_requests_in_flight", "gauge", "HTTP requests being answered.", metrics.in_flight),
+        Family(
+            "render_duration_seconds",
+            "histogram",
+            "Time render workers spent resizing an image.",
+            [*metrics.renders.samples({})],
+        ),
+    ]
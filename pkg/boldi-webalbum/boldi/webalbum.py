@@ -2,13 +2,21 @@ from __future__ import annotations
 
 import argparse
 import asyncio
+import atexit
+import base64
 import collections
+import concurrent.futures
 import contextlib
+import dataclasses
 import functools
+import gzip
+import hashlib
+import io
 import itertools
 import json
 import logging
 import math
+import os
 import pkgutil
 import re
 import shutil
@@ -16,19 +24,31 @@ import tomllib
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Iterator, Optional
+from typing import Any, ClassVar, Iterator, Optional
 
 import jinja2
+import numpy as np
 import pydantic
+import rich.console
+import rich.logging
 from exiftool import ExifToolHelper  # type: ignore[import-untyped]
 from PIL import Image
 from unidecode import unidecode
 
-from boldi.build import Builder, BuildSystem, FileHandler, Handler, Stamp, Target, stamp_file
+from boldi.build import Builder, BuildSystem, FileHandler, Handler, Stamp, Target, stamp_file, write_if_changed
+
+try:
+    import brotli  # type: ignore[import-not-found, import-untyped, unused-ignore]
+except ImportError:  # optional dependency, see the `brotli` extra
+    brotli = None
 
 _pkg_path = Path(__file__).with_suffix("")
 __path__ = pkgutil.extend_path([str(_pkg_path)], __name__)
 
+from boldi.webalbum.decode import MAX_IMAGE_PIXELS, decode_image  # after extending __path__
+from boldi.webalbum.layout import responsive_layout
+from boldi.webalbum.progress import BuildProgress, report_progress
+
 # Asyncio improvements:
 # https://pythonspeed.com/articles/two-thread-pools/
 # TODO CPU Thread Pool
@@ -53,6 +73,30 @@ logger.addHandler(logging.NullHandler())
 IMAGE_EXTENSIONS = (".JPG", ".JPEG", ".PNG", ".GIF")
 NON_URL_SAFE_RE = re.compile(r"[^\w\d\.\-\(\)_/]+", re.ASCII)
 RELEVANT_EXIF_TAGS = ["Composite:all", "EXIF:all", "File:all", "IPTC:all", "XMP:all"]
+COMPRESSED_SUFFIXES = (".gz", ".br") if brotli else (".gz",)
+NEAR_DUPLICATE_DISTANCE = 3
+"""The maximum number of differing bits between the dHashes of images reported as near-duplicates."""
+SEARCH_TERM_RE = re.compile(r"[a-z0-9]{2,}")
+MONTH_NAMES = (
+    "january",
+    "february",
+    "march",
+    "april",
+    "may",
+    "june",
+    "july",
+    "august",
+    "september",
+    "october",
+    "november",
+    "december",
+)
+"""The search terms of months, in English whatever the locale (unlike `strftime("%B")`)."""
+SEARCH_SHARD_PREFIX_LENGTH = 2
+"""Search index shards contain the terms starting with the same this many characters. Keep in sync with `script.js`."""
+PUBLISHED_MANIFEST_NAME = ".manifest.json"
+"""The manifest of the files published to a destination, kept there."""
+JINJA_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")).expanduser() / "boldi-webalbum" / "jinja"
 
 
 class FolderConfig(pydantic.BaseModel):
@@ -66,16 +110,29 @@ class AlbumConfig(pydantic.BaseModel):
     source: Path
     target: Path
     folders: dict[Path, FolderConfig] = {}
+    chunk_size: Optional[int] = None
+    """Folders with more images than this are split into chunks of this size, loaded on demand (disabled if `None`)."""
+    publish: Optional[Path] = None
+    """Where `--publish` copies the rendered album to, e.g. a mounted bucket."""
+    max_image_pixels: int = MAX_IMAGE_PIXELS
+    """Images are decoded with at most this many pixels (JPEGs once reduced), to bound memory (see `decode_image`)."""
 
     def model_post_init(self, __context: Any) -> None:
         self.source = self.source.expanduser()
         self.target = self.target.expanduser()
+        self.publish = self.publish.expanduser() if self.publish else None
 
 
-exiftool: ExifToolHelper = None  # type: ignore
+exiftool: Optional[ExifToolHelper] = None
+"""The exiftool process of the current process (e.g. of a worker), started by the first `get_exif_tags` call."""
 
 
 def get_exif_tags(image_path: Path) -> dict[str, Any]:
+    global exiftool
+    if exiftool is None:
+        exiftool = ExifToolHelper().__enter__()
+        # not run by forked workers, whose exiftool exits as its stdin is closed when they exit
+        atexit.register(exiftool.__exit__, None, None, None)
     raw_exif_tags = exiftool.get_tags(str(image_path), RELEVANT_EXIF_TAGS)[0]
     assert isinstance(raw_exif_tags, dict)
     exif_tags: collections.defaultdict[str, Any] = collections.defaultdict(dict)
@@ -105,6 +162,70 @@ def relative_to(path: Path, other: Path) -> Path:
         raise ValueError
 
 
+def image_placeholder(image_path: Path, size: int = 16, max_image_pixels: int = MAX_IMAGE_PIXELS) -> str:
+    pil_image, _ = decode_image(image_path, (size, size), max_image_pixels, "RGB")
+    with pil_image:
+        pil_image.thumbnail((size, size))
+        buffer = io.BytesIO()
+        pil_image.convert("RGB").save(buffer, "WEBP", quality=50)
+    return f"data:image/webp;base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+
+def hash_file(path: Path) -> tuple[str, int]:
+    """The SHA-256 digest and the size of a file."""
+    with open(path, "rb") as fp:
+        return hashlib.file_digest(fp, "sha256").hexdigest(), fp.tell()
+
+
+def hash_image(image_path: Path, max_image_pixels: int = MAX_IMAGE_PIXELS) -> tuple[str, Optional[int]]:
+    """
+    The SHA-256 digest of an image file, and the 64-bit difference hash (dHash) of its pixels.
+
+    The dHash is `None` if the image has too many pixels to decode (see `decode_image`).
+    """
+    with open(image_path, "rb") as fp:
+        sha256 = hashlib.file_digest(fp, "sha256").hexdigest()
+    try:
+        pil_image, _ = decode_image(image_path, (64, 64), max_image_pixels, "L")
+    except Image.DecompressionBombError:  # reported by `TargetImageHandler`
+        return sha256, None
+    with pil_image, pil_image.convert("L") as gray_image, gray_image.resize((9, 8), Image.Resampling.BOX) as tiny_image:
+        pixels = np.asarray(tiny_image, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return sha256, int(np.packbits(bits).view(">u8")[0])
+
+
+def resize_image(image_path: Path, resized_paths: dict[int, Path], max_image_pixels: int = MAX_IMAGE_PIXELS):
+    """Renders the versions of an image resized to each width, from a single decoding of it (see `decode_image`)."""
+    pil_image, (source_width, source_height) = decode_image(image_path, (max(resized_paths), 0), max_image_pixels)
+    with pil_image:
+        for width, resized_path in resized_paths.items():
+            height = round(width / source_width * source_height)
+            with pil_image.resize((width, height)) as resized_image:
+                resized_image.save(resized_path, quality=95, dpi=(240, 240))
+
+
+def near_duplicates(dhashes: dict[str, int], max_distance: int, bands: int = 4) -> list[tuple[str, str, int]]:
+    """
+    Pairs of keys whose dHashes differ in at most `max_distance` bits, with their distance.
+
+    Only keys whose dHashes are equal in at least one of `bands` parts (locality-sensitive hashing) are compared,
+    which finds all pairs as long as `max_distance < bands`.
+    """
+    band_bits = 64 // bands
+    buckets: collections.defaultdict[tuple[int, int], list[str]] = collections.defaultdict(list)
+    for key, dhash in dhashes.items():
+        for band in range(bands):
+            buckets[band, (dhash >> (band * band_bits)) & ((1 << band_bits) - 1)].append(key)
+    pairs: dict[tuple[str, str], int] = {}
+    for keys in buckets.values():
+        for pair in itertools.combinations(keys, 2):
+            distance = (dhashes[pair[0]] ^ dhashes[pair[1]]).bit_count()
+            if distance <= max_distance:
+                pairs[pair] = distance
+    return sorted((a, b, distance) for (a, b), distance in pairs.items())
+
+
 def to_safe_ascii(s: str) -> str:
     return NON_URL_SAFE_RE.sub("_", unidecode(s))
 
@@ -131,6 +252,34 @@ def human_round(f: float) -> str:
         return f"-{human_round(-f)}"
 
 
+def create_jinja_env() -> jinja2.Environment:
+    JINJA_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(_pkg_path / "templates"),
+        bytecode_cache=jinja2.FileSystemBytecodeCache(str(JINJA_CACHE_DIR)),
+        autoescape=True,
+        keep_trailing_newline=True,
+        line_statement_prefix="%%",
+        line_comment_prefix="%#",
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+    env.filters["to_safe_ascii"] = to_safe_ascii
+    env.filters["human_round"] = human_round
+    return env
+
+
+_worker_env: jinja2.Environment | None = None
+
+
+def render_template(name: str, context: dict[str, Any]) -> str:
+    """Renders a template in a worker process (or thread) using a per-worker Jinja environment."""
+    global _worker_env
+    if _worker_env is None:
+        _worker_env = create_jinja_env()
+    return _worker_env.get_template(name).render(context)
+
+
 @dataclass
 class SourceImage:
     path: Path
@@ -139,10 +288,15 @@ class SourceImage:
 @dataclass
 class SourceFolder:
     path: Path
+    only: Optional[Path] = None
+    """Only scan the subfolder at this path (and its ancestors), leave other subfolders unscanned."""
+    scanned: bool = True
     subfolders: dict[str, SourceFolder] = field(init=False, default_factory=dict)
     images: dict[str, SourceImage] = field(init=False, default_factory=dict)
 
     def __post_init__(self):
+        if not self.scanned:
+            return
         for item in sorted(self.path.iterdir()):
             name = item.name
             if name.startswith("."):
@@ -150,114 +304,297 @@ class SourceFolder:
             elif item.is_file() and item.suffix.upper() in IMAGE_EXTENSIONS:
                 self.images[name] = SourceImage(item)
             elif item.is_dir():
-                self.subfolders[name] = SourceFolder(item)
+                if self.only is None or item.is_relative_to(self.only):
+                    self.subfolders[name] = SourceFolder(item)
+                elif self.only.is_relative_to(item):
+                    self.subfolders[name] = SourceFolder(item, self.only)
+                else:
+                    self.subfolders[name] = SourceFolder(item, scanned=False)
+
+    def path_to_folder(self, path: Path) -> Optional[SourceFolder]:
+        if path == self.path:
+            return self
+        elif path.is_relative_to(self.path):
+            for subfolder in self.subfolders.values():
+                if (maybe_subfolder := subfolder.path_to_folder(path)) is not None:
+                    return maybe_subfolder
+        return None
+
+
+class ImageMetadata(pydantic.BaseModel):
+    """The subset of an image's EXIF data that is displayed on the album pages."""
+
+    title: str
+    description: str = ""
+    created_datetime: Optional[datetime] = None
+    width: int
+    height: int
+    rating: int = 0
+    focal_length: Optional[float] = None
+    focal_length_35mm: Optional[float] = None
+    aperture: Optional[float] = None
+    shutter_speed: Optional[float] = None
+    iso: Optional[float] = None
+    light_value: Optional[float] = None
+    exposure_compensation: Optional[float] = None
+    camera: str = ""
+    lens: str = ""
+    placeholder: str = ""
+    """A tiny, blurry version of the image as a `data:` URI, shown until the image itself loads."""
+
+    @pydantic.field_validator(
+        "focal_length",
+        "focal_length_35mm",
+        "aperture",
+        "shutter_speed",
+        "iso",
+        "light_value",
+        "exposure_compensation",
+        mode="before",
+    )
+    @classmethod
+    def _ignore_non_numeric(cls, value: Any) -> Any:
+        return value if isinstance(value, (int, float)) else None
+
+    @classmethod
+    def from_exif(cls, exif: dict[str, Any], default_title: str) -> ImageMetadata:
+        # exiftool leaves out the categories an image has no tags of (e.g. IPTC of images straight from the camera)
+        exif = collections.defaultdict(dict, exif)
+        w = exif["File"]["ImageWidth"]
+        assert w, f"missing width: {exif['SourceFile']}"
+        h = exif["File"]["ImageHeight"]
+        assert h, f"missing height: {exif['SourceFile']}"
+
+        return cls(
+            title=exif["IPTC"].get("ObjectName") or default_title,
+            description=exif["IPTC"].get("Caption-Abstract") or "",
+            created_datetime=cls._created_datetime(exif),
+            width=w,
+            height=h,
+            rating=exif["XMP"].get("Rating", 0),
+            focal_length=exif["EXIF"].get("FocalLength"),
+            focal_length_35mm=exif["Composite"].get("FocalLength35efl"),
+            aperture=exif["Composite"].get("Aperture"),
+            shutter_speed=exif["Composite"].get("ShutterSpeed"),
+            iso=exif["EXIF"].get("ISO"),
+            light_value=exif["Composite"].get("LightValue"),
+            exposure_compensation=exif["EXIF"].get("ExposureCompensation"),
+            camera=cls._make_and_model(exif["EXIF"].get("Make", ""), exif["EXIF"].get("Model", "")),
+            lens=cls._make_and_model(exif["EXIF"].get("LensMake", ""), exif["EXIF"].get("LensModel", "")),
+        )
+
+    def search_terms(self) -> list[str]:
+        """The terms this image can be found by: the words of its texts, and the year and month it was taken."""
+        text = f"{self.title} {self.description} {self.camera} {self.lens}"
+        terms = set(SEARCH_TERM_RE.findall(unidecode(text).lower()))
+        if self.created_datetime:
+            terms.add(f"{self.created_datetime.year}")
+            terms.add(MONTH_NAMES[self.created_datetime.month - 1])
+        return sorted(terms)
+
+    @staticmethod
+    def _created_datetime(exif: dict[str, Any]) -> Optional[datetime]:
+        created_str = exif["Composite"].get("DateTimeCreated") or exif["Composite"].get("DateTimeOriginal")
+        if not created_str:
+            return None
+        with contextlib.suppress(ValueError):
+            return datetime.strptime(created_str, "%Y:%m:%d %H:%M:%S%z")
+        with contextlib.suppress(ValueError):
+            return datetime.strptime(created_str, "%Y:%m:%d %H:%M:%S")
+        return None
+
+    @staticmethod
+    def _make_and_model(make: str, model: str) -> str:
+        if make == make.upper():
+            make = make.capitalize()
+        if model.startswith(make):
+            make = ""
+        return f"{make}{' ' if make and model else ''}{model}"
+
+
+class SourceHashes(pydantic.BaseModel):
+    """The hashes of a source image, valid as long as the stamp of the source file matches."""
+
+    stamp: Stamp
+    sha256: str
+    dhash: Optional[int]
+
+
+SourceIndex = pydantic.TypeAdapter(dict[str, SourceHashes])
+
+
+class SearchDocument(pydantic.BaseModel):
+    """The indexed parts of an image's metadata, valid as long as the stamp of the metadata file matches."""
+
+    stamp: Stamp
+    title: str
+    terms: list[str]
+
+    def shard_prefixes(self) -> set[str]:
+        return {term[:SEARCH_SHARD_PREFIX_LENGTH] for term in self.terms}
+
+
+SearchDocuments = pydantic.TypeAdapter(dict[str, SearchDocument])
+
+
+class ManifestEntry(pydantic.BaseModel):
+    """An output file of the album in its deploy manifest."""
+
+    stamp: Stamp
+    """The `stamp_file` stamp of the file when its digest was computed."""
+    size: int
+    sha256: str
+
+
+Manifest = pydantic.TypeAdapter(dict[str, ManifestEntry])
+
+
+class ManifestDiff(pydantic.BaseModel):
+    """The paths of the files added, changed (by content) and removed between two manifests."""
+
+    added: list[str] = []
+    changed: list[str] = []
+    removed: list[str] = []
+
+    @classmethod
+    def between(cls, old: dict[str, ManifestEntry], new: dict[str, ManifestEntry]) -> ManifestDiff:
+        return cls(
+            added=sorted(new.keys() - old.keys()),
+            changed=sorted(key for key in new.keys() & old.keys() if new[key].sha256 != old[key].sha256),
+            removed=sorted(old.keys() - new.keys()),
+        )
+
+    def __str__(self) -> str:
+        return f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed"
 
 
 @dataclass
 class TargetImage:
     source: SourceImage
     parent: TargetFolder
-    path: Path = field(init=False)
+    path: Path = None  # type: ignore[assignment]
     path_3000w: Path = field(init=False)
     path_1500w: Path = field(init=False)
     path_800w: Path = field(init=False)
     exif_path: Path = field(init=False)
+    metadata_path: Path = field(init=False)
 
     def __post_init__(self):
-        self.path = self.parent.path / to_safe_ascii(self.source.path.name)
+        self.path = self.path or self.parent.path / to_safe_ascii(self.source.path.name)
         self.path_3000w = self.path.with_suffix(f".3000{self.path.suffix}")
         self.path_1500w = self.path.with_suffix(f".1500{self.path.suffix}")
         self.path_800w = self.path.with_suffix(f".800{self.path.suffix}")
         self.exif_path = self.path.with_suffix(f"{self.path.suffix}.exif.json")
+        self.metadata_path = self.path.with_suffix(f"{self.path.suffix}.meta.json")
+
+    @property
+    def pixel_paths(self) -> list[Path]:
+        return [self.path, self.path_3000w, self.path_1500w, self.path_800w]
 
     @functools.cached_property
     def exif(self) -> dict[str, Any]:
         return json.loads(self.exif_path.read_text())
 
-    @property
-    def title(self) -> str:
-        return self.exif["IPTC"].get("ObjectName") or self.source.path.stem
+    @functools.cached_property
+    def metadata(self) -> ImageMetadata:
+        return ImageMetadata.model_validate_json(self.metadata_path.read_text())
+
+    def snapshot(self) -> ImageSnapshot:
+        return ImageSnapshot(
+            path=self.path,
+            path_3000w=self.path_3000w,
+            path_1500w=self.path_1500w,
+            path_800w=self.path_800w,
+            source_stem=self.source.path.stem,
+            metadata=self.metadata,
+        )
 
-    @property
-    def description(self) -> str:
-        return self.exif["IPTC"].get("Caption-Abstract") or ""
 
-    @property
-    def created_datetime(self) -> Optional[datetime]:
-        created_str = self.exif["Composite"].get("DateTimeCreated") or self.exif["Composite"].get("DateTimeOriginal")
-        if not created_str:
-            return None
-        with contextlib.suppress(ValueError):
-            return datetime.strptime(created_str, "%Y:%m:%d %H:%M:%S%z")
-        with contextlib.suppress(ValueError):
-            return datetime.strptime(created_str, "%Y:%m:%d %H:%M:%S")
-        return None
-
-    @property
-    def width(self) -> int:
-        w = self.exif["File"]["ImageWidth"]
-        assert w, f"missing width: {self.path.name}"
-        return w
+@dataclass
+class ImageSnapshot:
+    """Picklable copy of the parts of a `TargetImage` used by the templates."""
 
-    @property
-    def height(self) -> int:
-        h = self.exif["File"]["ImageHeight"]
-        assert h, f"missing height: {self.path.name}"
-        return h
+    path: Path
+    path_3000w: Path
+    path_1500w: Path
+    path_800w: Path
+    source_stem: str
+    metadata: ImageMetadata
 
-    @property
-    def rating(self) -> int:
-        return self.exif["XMP"].get("Rating", 0)
 
-    @property
-    def focal_length(self) -> Optional[float]:
-        return self.exif["EXIF"].get("FocalLength")
+@dataclass
+class FolderLinkSnapshot:
+    """Picklable copy of the parts of a `TargetFolder` used by the templates when linking to it."""
 
-    @property
-    def focal_length_35mm(self) -> Optional[float]:
-        return self.exif["Composite"].get("FocalLength35efl")
+    path: Path
+    title: str
+    cover_image: ImageSnapshot
 
-    @property
-    def aperture(self) -> Optional[float]:
-        return self.exif["Composite"].get("Aperture")
 
-    @property
-    def shutter_speed(self) -> Optional[float]:
-        return self.exif["Composite"].get("ShutterSpeed")
+@dataclass
+class FolderSnapshot:
+    """
+    Picklable copy of the parts of a `TargetFolder` used by the `index.html.j2` template.
 
-    @property
-    def iso(self) -> Optional[int]:
-        return self.exif["EXIF"].get("ISO")
+    Unlike `TargetFolder`, this doesn't reference the rest of the album,
+    so it can be sent to worker processes cheaply.
+    """
 
-    @property
-    def light_value(self) -> Optional[int]:
-        return self.exif["Composite"].get("LightValue")
+    path: Path
+    title: str
+    cover_image: ImageSnapshot
+    parent: Optional[FolderLinkSnapshot]
+    parents: list[FolderLinkSnapshot]
+    prev_folder: Optional[FolderLinkSnapshot]
+    next_folder: Optional[FolderLinkSnapshot]
+    subfolders: dict[str, FolderLinkSnapshot]
+    images: dict[str, ImageSnapshot]
 
-    @property
-    def exposure_compensation(self) -> Optional[int]:
-        return self.exif["EXIF"].get("ExposureCompensation")
 
-    @property
-    def camera(self) -> str:
-        make: str = self.exif["EXIF"].get("Make", "")
-        if make == make.upper():
-            make = make.capitalize()
+@dataclass(frozen=True)
+class ImageUrls:
+    src: str
+    w800: str
+    w1500: str
+    w3000: str
+    srcset: str
 
-        model: str = self.exif["EXIF"].get("Model", "")
-        if model.startswith(make):
-            make = ""
-        return f"{make}{' ' if make and model else ''}{model}"
-
-    @property
-    def lens(self) -> str:
-        make: str = self.exif["EXIF"].get("LensMake", "")
-        if make == make.upper():
-            make = make.capitalize()
 
-        model: str = self.exif["EXIF"].get("LensModel", "")
-        if model.startswith(make):
-            make = ""
-        return f"{make}{' ' if make and model else ''}{model}"
+@dataclass
+class UrlResolver:
+    """
+    Relative URLs of target paths as seen from the page of the folder at `base`, as used by the templates.
+
+    Replaces the `relative_to` filter in the templates: the URLs of directories are computed once per page,
+    and the URLs of files and image renditions are built from them.
+    """
+
+    base: Path
+    _dir_urls: dict[Path, str] = field(default_factory=dict, repr=False)
+    _image_urls: dict[Path, ImageUrls] = field(default_factory=dict, repr=False)
+
+    def dir(self, path: Path) -> str:
+        url = self._dir_urls.get(path)
+        if url is None:
+            url = self._dir_urls[path] = relative_to(path, self.base).as_posix()
+        return url
+
+    def file(self, path: Path) -> str:
+        dir_url = self.dir(path.parent)
+        return path.name if dir_url == "." else f"{dir_url}/{path.name}"
+
+    def folder(self, path: Path) -> str:
+        return f"{self.dir(path)}/index.html"
+
+    def image(self, image: ImageSnapshot) -> ImageUrls:
+        urls = self._image_urls.get(image.path)
+        if urls is None:
+            src, w800, w1500, w3000 = (
+                self.file(path) for path in (image.path, image.path_800w, image.path_1500w, image.path_3000w)
+            )
+            srcset = f"{w800} 800w, {w1500} 1500w, {w3000} 3000w, {src}"
+            urls = self._image_urls[image.path] = ImageUrls(src, w800, w1500, w3000, srcset)
+        return urls
 
 
 @dataclass
@@ -290,7 +627,7 @@ class TargetFolder:
         prev_subfolder = self.prev_folder
         for source_subfolder in self.source.subfolders.values():
             subfolder = TargetFolder(source_subfolder, self, self.album_config, prev_folder=prev_subfolder)
-            if subfolder.total_image_count != 0:  # ignore empty folders
+            if not subfolder.is_empty:  # ignore empty folders
                 if prev_subfolder:
                     if not prev_subfolder.next_folder:
                         prev_subfolder.next_folder = subfolder
@@ -312,6 +649,13 @@ class TargetFolder:
         subfolders_image_count = sum(s.total_image_count for s in self.subfolders.values())
         self.total_image_count = len(self.images) + subfolders_image_count
 
+    @property
+    def is_empty(self) -> bool:
+        if not self.source.scanned:
+            # the images of an unscanned folder are unknown, but it had some if it was built before
+            return not (self.path / "index.html").exists()
+        return self.total_image_count == 0
+
     @functools.cached_property
     def title(self) -> str:
         return self.config.title or self.source.path.name
@@ -322,7 +666,49 @@ class TargetFolder:
             self.images.values(),
             [subfolder.cover_image for subfolder in self.subfolders.values() if subfolder.cover_image],
         )
-        return max(candidate_album_images, key=lambda image: image.rating)
+        return max(candidate_album_images, key=lambda image: image.metadata.rating)
+
+    def link_snapshot(self) -> FolderLinkSnapshot:
+        return FolderLinkSnapshot(self.path, self.title, self.cover_image.snapshot())
+
+    def snapshot(self) -> FolderSnapshot:
+        return FolderSnapshot(
+            path=self.path,
+            title=self.title,
+            cover_image=self.cover_image.snapshot(),
+            parent=self.parent.link_snapshot() if self.parent else None,
+            parents=[parent.link_snapshot() for parent in self.parents],
+            prev_folder=self.prev_folder.link_snapshot() if self.prev_folder else None,
+            next_folder=self.next_folder.link_snapshot() if self.next_folder else None,
+            subfolders={name: subfolder.link_snapshot() for name, subfolder in self.subfolders.items()},
+            images={name: image.snapshot() for name, image in self.images.items()},
+        )
+
+    def chunk_paths(self) -> list[Path]:
+        """The `index.N.json` chunks of images after the first `chunk_size` images inlined in `index.html`."""
+        chunk_size = self.album_config.chunk_size
+        if not chunk_size:
+            return []
+        chunk_count = math.ceil(len(self.images) / chunk_size) - 1
+        return [self.path / f"index.{i}.json" for i in range(1, chunk_count + 1)]
+
+    @property
+    def cover_target(self) -> Target:
+        return f"//cover/{self.path}"
+
+    @property
+    def nav_target(self) -> Target:
+        return f"//nav/{self.path}"
+
+    def invalidate_cover_image(self):
+        self.__dict__.pop("cover_image", None)
+        if self.parent:
+            self.parent.invalidate_cover_image()
+
+    def all_folders(self) -> Iterator[TargetFolder]:
+        yield self
+        for subfolder in self.subfolders.values():
+            yield from subfolder.all_folders()
 
     def all_images(self) -> Iterator[TargetImage]:
         yield from self.images.values()
@@ -362,32 +748,217 @@ class TargetFolderHandler(FileHandler):
         target_folder = self.target_folder(target)
 
         target_folder.path.mkdir(parents=True, exist_ok=True)
-        await builder.add_source(str(target_folder.source.path))
 
-        for image in target_folder.all_images():
-            await builder.build(str(image.path))
+        await asyncio.gather(
+            *(builder.build(target) for target in self.album.page_targets(target_folder)),
+            *(builder.build(str(image.path)) for image in target_folder.images.values()),
+            *(builder.build(str(subfolder.path)) for subfolder in target_folder.subfolders.values()),
+        )
+
 
-        for subfolder in target_folder.subfolders.values():
-            await builder.build(str(subfolder.path))
+@dataclass
+class TargetFolderIndexHandler(FileHandler):
+    """
+    Renders the `index.html` page of a folder.
+
+    The page only depends on the metadata of the images it displays and on the folder covers it links to,
+    so re-encoding the image derivatives doesn't re-render it.
+    """
+
+    album: Album
+
+    def maybe_target_folder(self, target: Target) -> Optional[TargetFolder]:
+        path = Path(target)
+        if path.name != "index.html":
+            return None
+        return self.album.target_root.path_to_folder(path.parent)
+
+    def target_folder(self, target: Target) -> TargetFolder:
+        maybe_target_folder = self.maybe_target_folder(target)
+        assert maybe_target_folder
+        return maybe_target_folder
 
-        index_html = target_folder.path / "index.html"
+    def can_handle(self, target: Target) -> bool:
+        return self.maybe_target_folder(target) is not None
+
+    def stamp(self, target: Target) -> Stamp:
+        target_folder = self.target_folder(target)
+        return "; ".join(stamp_file(str(path)) for path in [Path(target), *target_folder.chunk_paths()])
 
-        index_template = self.album.env.get_template("index.html.j2")
-        stream = index_template.stream({"folder": target_folder})
-        with open(index_html, "wt") as fp:
-            stream.dump(fp)  # type: ignore[arg-type] # https://github.com/pallets/jinja/issues/1983
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        target_folder = self.target_folder(target)
+
+        target_folder.path.mkdir(parents=True, exist_ok=True)
+        await builder.add_source(str(target_folder.source.path))
+        if target_folder.parent:
+            await builder.add_source(str(target_folder.parent.source.path))
+
+        related_folders = [target_folder, target_folder.prev_folder, target_folder.next_folder, target_folder.parent]
+        related_folders.extend(target_folder.subfolders.values())
+        await asyncio.gather(
+            builder.build(target_folder.nav_target),
+            *(builder.build(str(image.metadata_path)) for image in target_folder.images.values()),
+            *(builder.build(folder.cover_target) for folder in related_folders if folder),
+        )
+
+        folder = target_folder.snapshot()
+        chunk_paths = target_folder.chunk_paths()
+        images = list(folder.images.values())
+        chunk_size = self.album.config.chunk_size or len(images) or 1
+        pages = [images[i : i + chunk_size] for i in range(0, len(images), chunk_size)] or [[]]
+        assert len(pages) == len(chunk_paths) + 1
+        thumbnail_layout = responsive_layout([image.metadata.width / image.metadata.height for image in images])
+        thumbnail_breaks = [thumbnail_layout.breaks[i : i + chunk_size] for i in range(0, len(images), chunk_size)]
+        subfolder_covers = [subfolder.cover_image.metadata for subfolder in folder.subfolders.values()]
+
+        index_context = {
+            "folder": folder,
+            "album": self.album.config,
+            "static": self.album.target_static,
+            "urls": UrlResolver(folder.path),
+            "images": pages[0],
+            "next_image": pages[1][0] if chunk_paths else None,
+            "thumbnail_breaks": thumbnail_breaks[0] if images else [],
+            "thumbnail_slacks": thumbnail_layout.slacks,
+            "subfolder_layout": responsive_layout([cover.width / cover.height for cover in subfolder_covers]),
+            "chunks": [
+                {"url": path.name, "ids": [image.path.stem for image in page]}
+                for path, page in zip(chunk_paths, pages[1:])
+            ],
+        }
+        # chunks only need the folder's path and title, don't send all images to each worker
+        chunk_folder = dataclasses.replace(folder, images={}, subfolders={})
+        chunk_contexts = [
+            {
+                "folder": chunk_folder,
+                "urls": UrlResolver(folder.path),
+                "images": pages[i],
+                "thumbnail_breaks": thumbnail_breaks[i],
+                "prev_image": pages[i - 1][-1],
+                "next_image": pages[i + 1][0] if i + 1 < len(pages) else None,
+            }
+            for i in range(1, len(pages))
+        ]
+        html, *chunks = await asyncio.gather(
+            self.album.render_template("index.html.j2", index_context),
+            *(self.album.render_template("index.json.j2", context) for context in chunk_contexts),
+        )
+
+        write_if_changed(Path(target), html)
+        for path, chunk in zip(chunk_paths, chunks):
+            write_if_changed(path, chunk)
+        chunk_files = {Path(file) for path in chunk_paths for file in [path, *self.album.compressed_targets(str(path))]}
+        for path in target_folder.path.glob("index.*.json*"):
+            if path not in chunk_files:
+                path.unlink()
         for template_file in (_pkg_path / "templates").iterdir():
-            await builder.add_source(str(template_file))
+            if template_file.is_file():
+                await builder.add_source(str(template_file))
 
         await builder.add_source(__file__)
 
 
 @dataclass
-class TargetImageHandler(FileHandler):
+class FolderCoverHandler(Handler):
+    """
+    Virtual `//cover/...` target that tracks which image is the cover of a folder, and that image's metadata.
+
+    Pages depend on this instead of the metadata of every image under a folder they link to.
+    """
+
+    album: Album
+
+    def maybe_target_folder(self, target: Target) -> Optional[TargetFolder]:
+        if not target.startswith("//cover/"):
+            return None
+        return self.album.target_root.path_to_folder(Path(target.removeprefix("//cover/")))
+
+    def can_handle(self, target: Target) -> bool:
+        # also the covers of removed folders, which the pages that linked to them still depend on
+        return target.startswith("//cover/")
+
+    def stamp(self, target: Target) -> Stamp:
+        target_folder = self.maybe_target_folder(target)
+        with contextlib.suppress(OSError, ValueError):  # pydantic.ValidationError is a ValueError
+            if target_folder is None:
+                return ""
+            cover_image = target_folder.cover_image
+            return f"{cover_image.metadata_path} {stamp_file(str(cover_image.metadata_path))}"
+        return ""
+
+    @staticmethod
+    def cover_metadata_path(stamp: Stamp) -> Optional[Path]:
+        """The metadata path of the cover image in a stamp of a `//cover/...` target, if any."""
+        # a `stamp_file` stamp has 8 fields
+        return Path(stamp.rsplit(" ", 8)[0]) if stamp else None
+
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        target_folder = self.maybe_target_folder(target)
+        if target_folder is None:
+            return  # removed, its dependents are rebuilt as its stamp changed
+
+        await builder.add_source(str(target_folder.source.path))
+
+        for image in target_folder.images.values():
+            await builder.build(str(image.metadata_path))
+
+        for subfolder in target_folder.subfolders.values():
+            await builder.build(subfolder.cover_target)
+
+
+@dataclass
+class FolderNavHandler(Handler):
+    """
+    Virtual `//nav/...` target that tracks the folders the page of a folder links to: its previous, next and parent ones.
+
+    The previous and next folders may be anywhere in the album (e.g. the next one of the last subfolder of a folder), so
+    the page depends on this instead of on the source folders that decide them.
+    """
+
     album: Album
 
+    def can_handle(self, target: Target) -> bool:
+        return target.startswith("//nav/")
+
+    def stamp(self, target: Target) -> Stamp:
+        target_folder = self.album.target_root.path_to_folder(Path(target.removeprefix("//nav/")))
+        if target_folder is None:
+            return ""
+        related_folders = [target_folder.prev_folder, target_folder.next_folder, *target_folder.parents]
+        return json.dumps([[str(folder.path), folder.title] if folder else None for folder in related_folders])
+
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        pass  # the stamp is all there is to it
+
+
+@dataclass
+class SourceFolderHandler(Handler):
+    """Stamps a source folder by the names it contains, so that adding, removing or renaming items is detected."""
+
+    album: Album
+
+    def can_handle(self, target: Target) -> bool:
+        return self.album.source_root.path_to_folder(Path(target)) is not None
+
+    def stamp(self, target: Target) -> Stamp:
+        with contextlib.suppress(OSError):
+            names = sorted(name for name in os.listdir(target) if not name.startswith("."))
+            return hashlib.sha256("\0".join(names).encode()).hexdigest()
+        return ""
+
+
+@dataclass
+class TargetImageFileHandler(FileHandler):
+    """Base class of handlers of the files generated for a `TargetImage`, with names ending in `suffix`."""
+
+    album: Album
+    suffix: ClassVar[str] = ""
+
     def maybe_target_image(self, target: Target) -> Optional[TargetImage]:
-        return self.album.target_root.path_to_image(Path(target))
+        path = Path(target)
+        if not path.name.endswith(self.suffix):
+            return None
+        return self.album.target_root.path_to_image(path.with_name(path.name.removesuffix(self.suffix)))
 
     def target_image(self, target: Target) -> TargetImage:
         maybe_target_image = self.maybe_target_image(target)
@@ -397,132 +968,651 @@ class TargetImageHandler(FileHandler):
     def can_handle(self, target: Target) -> bool:
         return self.maybe_target_image(target) is not None
 
+
+@dataclass
+class TargetImageHandler(TargetImageFileHandler):
+    """
+    Copies an image and renders its resized versions.
+
+    Exact duplicates of an image built earlier (see `SourceIndexHandler`) are hardlinked to its files instead.
+    """
+
     def stamp(self, target: Target) -> Stamp:
         image = self.target_image(target)
-        return "; ".join(
-            stamp_file(str(path))
-            for path in [image.path, image.path_3000w, image.path_1500w, image.path_800w, image.exif_path]
-        )
+        # the ctime of the files changes when duplicates are hardlinked to them
+        return "; ".join(stamp_file(str(path), include_ctime=False) for path in image.pixel_paths)
 
     async def rebuild_impl(self, target: Target, builder: Builder):
         image = self.target_image(target)
 
         image.path.parent.mkdir(parents=True, exist_ok=True)
+        # don't overwrite the contents of files hardlinked to (or from) another image's files
+        for path in image.pixel_paths:
+            path.unlink(missing_ok=True)
+
+        await builder.add_source(str(image.source.path))
+
+        if original := self.album.duplicate_of.get(image.path):
+            await builder.build(str(original.path))
+            for original_path, path in zip(original.pixel_paths, image.pixel_paths):
+                try:
+                    os.link(original_path, path)
+                except OSError:  # e.g. the file system doesn't support hardlinks
+                    shutil.copy2(original_path, path)
+            return
+
         shutil.copy(image.source.path, image.path)
 
-        with Image.open(image.path) as pil_image:
-            w, h = 3000, round(3000 / pil_image.size[0] * pil_image.size[1])
-            with pil_image.resize((w, h)) as resized_image:
-                resized_image.save(image.path_3000w, quality=95, dpi=(240, 240))
+        resized_paths = {3000: image.path_3000w, 1500: image.path_1500w, 800: image.path_800w}
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self.album.executor, resize_image, image.path, resized_paths, self.album.config.max_image_pixels
+            )
+        except Image.DecompressionBombError as error:
+            # an image too large to decode doesn't fail the album, only its resized versions are missing
+            logger.warning(f"not resizing {image.source.path}: {error}")
+
 
-            w, h = 1500, round(1500 / pil_image.size[0] * pil_image.size[1])
-            with pil_image.resize((w, h)) as resized_image:
-                resized_image.save(image.path_1500w, quality=95, dpi=(240, 240))
+@dataclass
+class TargetImageExifHandler(TargetImageFileHandler):
+    suffix: ClassVar[str] = ".exif.json"
 
-            w, h = 800, round(800 / pil_image.size[0] * pil_image.size[1])
-            with pil_image.resize((w, h)) as resized_image:
-                resized_image.save(image.path_800w, quality=95, dpi=(240, 240))
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        image = self.target_image(target)
 
-        with open(image.exif_path, "w") as fp:
-            json.dump(get_exif_tags(image.source.path), fp, indent=2)
+        image.path.parent.mkdir(parents=True, exist_ok=True)
+        exif_tags = await self.album.get_exif_tags(image.source.path)
+        write_if_changed(image.exif_path, json.dumps(exif_tags, indent=2))
+        image.__dict__.pop("exif", None)
 
         await builder.add_source(str(image.source.path))
-        await builder.add_source(str(image.path_3000w))
-        await builder.add_source(str(image.path_1500w))
-        await builder.add_source(str(image.path_800w))
-        await builder.add_source(str(image.exif_path))
 
 
 @dataclass
-class StaticHandler(Handler):
+class TargetImageMetadataHandler(TargetImageFileHandler):
+    """
+    Extracts the displayed `ImageMetadata` of an image from its EXIF data, and computes its placeholder.
+
+    The file is only rewritten when its contents change,
+    so pages depending on it aren't re-rendered when the source file is touched but the metadata stays the same.
+    """
+
+    suffix: ClassVar[str] = ".meta.json"
+
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        image = self.target_image(target)
+
+        await builder.build(str(image.exif_path))
+
+        metadata = ImageMetadata.from_exif(image.exif, default_title=image.source.path.stem)
+        with contextlib.suppress(Image.DecompressionBombError):  # reported by `TargetImageHandler`
+            metadata.placeholder = await self.album.get_image_placeholder(image.source.path)
+        write_if_changed(image.metadata_path, metadata.model_dump_json(indent=2))
+        image.__dict__["metadata"] = metadata
+        image.parent.invalidate_cover_image()
+
+        await builder.add_source(str(image.source.path))
+        await builder.add_source(__file__)
+
+
+@dataclass
+class SourceIndexHandler(Handler):
+    """
+    Virtual `//sources` target that indexes the hashes of all source images, and finds their duplicates.
+
+    Exact duplicates are recorded in `Album.duplicate_of` to reuse the first copy's files, near-duplicates are reported.
+    Only the hashes of sources whose stamps changed are recomputed, the rest are kept in `Album.source_index_path`.
+    """
+
     album: Album
-    files: dict[str, Path] = field(init=False)
 
-    def __post_init__(self):
-        self.files = {
-            f"static/{file.name}": self.album.target_static / file.name
-            for file in sorted((_pkg_path / "templates" / "static").iterdir())
+    def can_handle(self, target: Target) -> bool:
+        return target == "//sources"
+
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        index = self.album.source_index
+        images = sorted(self.album.target_root.all_images(), key=lambda image: image.path)
+        stamps = {str(image.source.path): stamp_file(str(image.source.path)) for image in images}
+
+        changed = [source for source, stamp in stamps.items() if source not in index or index[source].stamp != stamp]
+        loop = asyncio.get_running_loop()
+        hashes = await asyncio.gather(
+            *(
+                loop.run_in_executor(self.album.executor, hash_image, Path(source), self.album.config.max_image_pixels)
+                for source in changed
+            )
+        )
+        for source, (sha256, dhash) in zip(changed, hashes):
+            index[source] = SourceHashes(stamp=stamps[source], sha256=sha256, dhash=dhash)
+        for source in index.keys() - stamps.keys():
+            if not self.album.is_frozen(source):
+                del index[source]
+        write_if_changed(self.album.source_index_path, SourceIndex.dump_json(dict(sorted(index.items())), indent=2))
+
+        originals: dict[str, TargetImage] = {}
+        self.album.duplicate_of.clear()
+        for image in images:
+            original = originals.setdefault(index[str(image.source.path)].sha256, image)
+            if original is not image:
+                logger.info(f"duplicate image: {image.source.path} is the same as {original.source.path}")
+                self.album.duplicate_of[image.path] = original
+
+        dhashes = {
+            str(image.source.path): dhash
+            for image in originals.values()
+            if (dhash := index[str(image.source.path)].dhash) is not None
         }
+        for a, b, distance in near_duplicates(dhashes, NEAR_DUPLICATE_DISTANCE):
+            logger.warning(f"near-duplicate images: {a} and {b} (dHash distance: {distance})")
+
+
+@dataclass
+class SearchIndexHandler(Handler):
+    """
+    Virtual `//search` target that writes the album's static search index, an inverted index sharded by term prefix.
+
+    Each `search/<prefix>.json` shard maps its terms to the images they're found in, relative to the album root,
+    and has the titles of these images.
+    Only the terms of images whose metadata changed are recomputed, and only the shards they affect are rewritten.
+    """
+
+    album: Album
 
     def can_handle(self, target: Target) -> bool:
-        return target == "//static"
+        return target == "//search"
+
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        search_path = self.album.search_path
+        documents = self.album.search_documents
+        if not search_path.is_dir():
+            documents.clear()
+        search_path.mkdir(parents=True, exist_ok=True)
+
+        root = self.album.target_root.path
+        images = {image.path.relative_to(root).as_posix(): image for image in self.album.target_root.all_images()}
+        changed_prefixes: set[str] = set()
+        for key in documents.keys() - images.keys():
+            if not self.album.is_frozen(str(root / key)):
+                changed_prefixes |= documents.pop(key).shard_prefixes()
+        for key, image in images.items():
+            stamp = stamp_file(str(image.metadata_path))
+            old_document = documents.get(key)
+            if old_document is None or old_document.stamp != stamp:
+                metadata = image.metadata
+                document = SearchDocument(stamp=stamp, title=metadata.title, terms=metadata.search_terms())
+                if old_document is None or (old_document.title, old_document.terms) != (document.title, document.terms):
+                    changed_prefixes |= document.shard_prefixes()
+                    changed_prefixes |= old_document.shard_prefixes() if old_document else set()
+                documents[key] = document
+
+        shards: dict[str, dict[str, list[str]]] = {prefix: {} for prefix in changed_prefixes}
+        for key, document in sorted(documents.items()):
+            for term in document.terms:
+                if (shard := shards.get(term[:SEARCH_SHARD_PREFIX_LENGTH])) is not None:
+                    shard.setdefault(term, []).append(key)
+        for prefix, terms in shards.items():
+            shard_path = search_path / f"{prefix}.json"
+            if terms:
+                keys = sorted({key for keys in terms.values() for key in keys})
+                shard_json = {
+                    "terms": dict(sorted(terms.items())),
+                    "titles": {key: documents[key].title for key in keys},
+                }
+                write_if_changed(shard_path, json.dumps(shard_json, separators=(",", ":"), ensure_ascii=False))
+            else:
+                shard_path.unlink(missing_ok=True)
+
+        write_if_changed(self.album.search_documents_path, SearchDocuments.dump_json(documents, indent=2))
+
+
+@dataclass
+class ManifestHandler(Handler):
+    """
+    Virtual `//manifest` target that lists every output file of the album with its digest, size and stamp.
+
+    The manifest is written to `Album.manifest_path`, and its difference to the previous one to `Album.manifest_diff_path`.
+    Only the files whose stamps changed are hashed again.
+    """
+
+    album: Album
+
+    def can_handle(self, target: Target) -> bool:
+        return target == "//manifest"
+
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        root = self.album.target_root.path
+        old_manifest = self.album.manifest
+        internal_paths = {path.absolute() for path in self.album.internal_paths}
+
+        # the files of frozen folders weren't built, so they are as they were in the last manifest
+        manifest = {key: entry for key, entry in old_manifest.items() if self.album.is_frozen(str(root / key))}
+        stamps: dict[str, Stamp] = {}
+        for dir_path, dir_names, file_names in os.walk(root):
+            dir_names[:] = [name for name in dir_names if not self.album.is_frozen(os.path.join(dir_path, name))]
+            for name in file_names:
+                path = Path(dir_path, name)
+                # hidden files are the temporary files of `write_if_changed`
+                if not name.startswith(".") and path.absolute() not in internal_paths:
+                    stamps[path.relative_to(root).as_posix()] = stamp_file(str(path), include_ctime=False)
+
+        changed = [key for key, stamp in stamps.items() if key not in old_manifest or old_manifest[key].stamp != stamp]
+        loop = asyncio.get_running_loop()
+        hashes = await asyncio.gather(
+            *(loop.run_in_executor(self.album.executor, hash_file, root / key) for key in changed)
+        )
+        new_entries = {
+            key: ManifestEntry(stamp=stamps[key], size=size, sha256=sha256)
+            for key, (sha256, size) in zip(changed, hashes)
+        }
+        for key in sorted(stamps.keys()):
+            manifest[key] = new_entries.get(key) or old_manifest[key]
+
+        diff = ManifestDiff.between(old_manifest, manifest)
+        logger.info(f"manifest: {diff}")
+        self.album.manifest = dict(sorted(manifest.items()))
+        write_if_changed(self.album.manifest_path, Manifest.dump_json(self.album.manifest, indent=2))
+        write_if_changed(self.album.manifest_diff_path, diff.model_dump_json(indent=2))
+
+
+@dataclass
+class FrozenHandler(Handler):
+    """
+    Targets in the folders that a partial build leaves unscanned, see `Album.only`.
+
+    They aren't built, and keep their stamps from the last build,
+    so the targets that depend on them are only rebuilt if they themselves changed.
+    """
+
+    album: Album
+
+    def can_handle(self, target: Target) -> bool:
+        return self.album.is_frozen(target)
 
     def stamp(self, target: Target) -> Stamp:
-        return "; ".join(stamp_file(str(file)) for file in self.files.values())
+        return self.album.db.targets.get(target, "")
+
+
+@dataclass
+class StaticHandler(Handler):
+    """Virtual `//static` target that builds all static files."""
+
+    album: Album
+
+    def can_handle(self, target: Target) -> bool:
+        return target == "//static"
 
     async def rebuild_impl(self, target: Target, builder: Builder):
         assert target == "//static"
+        await asyncio.gather(
+            *(
+                builder.build(static_target)
+                for static_file in self.album.static_files
+                for static_target in [static_file, *self.album.compressed_targets(static_file)]
+            )
+        )
+
+
+@dataclass
+class StaticFileHandler(FileHandler):
+    album: Album
+
+    def can_handle(self, target: Target) -> bool:
+        return target in self.album.static_files
+
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        template_name = self.album.static_files[target]
         self.album.target_static.mkdir(parents=True, exist_ok=True)
-        for source, target_file in self.files.items():
-            await builder.add_source(str(_pkg_path / "templates" / source))
-            template = self.album.env.get_template(source)
-            stream = template.stream()
-            with open(target_file, "w") as fp:
-                stream.dump(fp)  # type: ignore[arg-type] # https://github.com/pallets/jinja/issues/1983
+        await builder.add_source(str(_pkg_path / "templates" / template_name))
+        text = await self.album.render_template(template_name, {})
+        write_if_changed(Path(target), text)
+
+
+@dataclass
+class CompressedHandler(FileHandler):
+    """
+    Precompressed `.gz` and `.br` variants of text outputs, so that web servers can serve them as-is.
+
+    `.br` files are only generated if the optional `brotli` module is available.
+    """
+
+    album: Album
+
+    def can_handle(self, target: Target) -> bool:
+        uncompressed, suffix = os.path.splitext(target)
+        return suffix in COMPRESSED_SUFFIXES and self.album.is_compressible(uncompressed)
+
+    async def rebuild_impl(self, target: Target, builder: Builder):
+        uncompressed, suffix = os.path.splitext(target)
+        await builder.build(self.album.page_of_chunk(uncompressed) or uncompressed)
+        data = Path(uncompressed).read_bytes()
+        if suffix == ".gz":
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        else:
+            assert suffix == ".br" and brotli
+            compressed = brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
+        write_if_changed(Path(target), compressed)
 
 
 @dataclass
 class Album(BuildSystem):
     config: AlbumConfig
+    executor: Optional[concurrent.futures.Executor] = None
+    only: Optional[Path] = None
+    """
+    Only build the subfolder at this path (relative to the album's source), and the pages of its ancestors.
+
+    Only that subfolder and its ancestors are scanned, the other folders are left as they were by the last build.
+    """
+    source_root: SourceFolder = field(init=False)
     target_root: TargetFolder = field(init=False)
+    build_root: TargetFolder = field(init=False)
+    """The folder to build, the album's root unless `only` is set."""
+    frozen_folders: list[TargetFolder] = field(init=False)
+    """The unscanned folders of a partial build, whose targets are frozen."""
+    frozen_paths: set[Path] = field(init=False)
+    env: jinja2.Environment = field(default_factory=create_jinja_env)
+    """The Jinja environment used without an executor, it can be shared by albums."""
+    progress: Optional[BuildProgress] = None
+    """Counts the targets built by `render`, it can be shared by albums."""
+    _target_handlers: dict[Target, Handler] = field(init=False, default_factory=dict)
+    _rebuilt_targets: set[Target] = field(init=False, default_factory=set)
+    _done_targets: set[Target] = field(init=False, default_factory=set)
     target_static: Path = field(init=False)
-    env: jinja2.Environment = field(init=False)
+    static_files: dict[Target, str] = field(init=False)
+    source_index_path: Path = field(init=False)
+    source_index: dict[str, SourceHashes] = field(init=False, default_factory=dict)
+    duplicate_of: dict[Path, TargetImage] = field(init=False, default_factory=dict)
+    search_path: Path = field(init=False)
+    search_documents_path: Path = field(init=False)
+    search_documents: dict[str, SearchDocument] = field(init=False, default_factory=dict)
+    manifest_path: Path = field(init=False)
+    manifest_diff_path: Path = field(init=False)
+    manifest: dict[str, ManifestEntry] = field(init=False, default_factory=dict)
 
     def __post_init__(self):
-        self.target_root = TargetFolder(SourceFolder(self.config.source), None, self.config, None, self.config.target)
+        only = self.config.source / self.only if self.only else None
+        if only is not None and not (only.is_relative_to(self.config.source) and only.is_dir()):
+            raise ValueError(f"{only} is not a folder of the album")
+        self.source_root = SourceFolder(self.config.source, only)
+        self.target_root = TargetFolder(self.source_root, None, self.config, None, self.config.target)
+        folders = list(self.target_root.all_folders())
+        maybe_build_root = next((folder for folder in folders if folder.source.path == only), self.target_root)
+        if only is not None and maybe_build_root.source.path != only:
+            raise ValueError(f"{only} has no images")
+        self.build_root = maybe_build_root
+        self.frozen_folders = [folder for folder in folders if not folder.source.scanned]
+        self.frozen_paths = {path for folder in self.frozen_folders for path in [folder.path, folder.source.path]}
         self.target_static = self.target_root.path / "static"
-
-        self.env = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(_pkg_path / "templates"),
-            autoescape=True,
-            keep_trailing_newline=True,
-            line_statement_prefix="%%",
-            line_comment_prefix="%#",
-            trim_blocks=True,
-            lstrip_blocks=True,
-        )
-        self.env.globals = {
-            "album": self,
-            "root": self.target_root.path,
+        self.static_files = {
+            str(self.target_static / file.name): f"static/{file.name}"
+            for file in sorted((_pkg_path / "templates" / "static").iterdir())
         }
-        self.env.filters["relative_to"] = relative_to
-        self.env.filters["to_safe_ascii"] = to_safe_ascii
-        self.env.filters["human_round"] = human_round
+        self.source_index_path = self.db_path.with_name("sources.db.json")
+        self.search_path = self.target_root.path / "search"
+        self.search_documents_path = self.db_path.with_name("search.db.json")
+        self.manifest_path = self.db_path.with_name("manifest.json")
+        self.manifest_diff_path = self.db_path.with_name("manifest.diff.json")
 
+        self.handlers.append(FrozenHandler(self))
         self.handlers.append(TargetFolderHandler(self))
+        self.handlers.append(TargetFolderIndexHandler(self))
+        self.handlers.append(FolderCoverHandler(self))
+        self.handlers.append(FolderNavHandler(self))
         self.handlers.append(TargetImageHandler(self))
+        self.handlers.append(TargetImageExifHandler(self))
+        self.handlers.append(TargetImageMetadataHandler(self))
+        self.handlers.append(SourceFolderHandler(self))
+        self.handlers.append(SourceIndexHandler(self))
+        self.handlers.append(SearchIndexHandler(self))
+        self.handlers.append(ManifestHandler(self))
         self.handlers.append(StaticHandler(self))
+        self.handlers.append(StaticFileHandler(self))
+        self.handlers.append(CompressedHandler(self))
         self.handlers.append(FileHandler())
 
     async def init(self):
         await self.load_build_db()
+        with contextlib.suppress(OSError, ValueError):
+            self.source_index = SourceIndex.validate_json(self.source_index_path.read_bytes())
+        with contextlib.suppress(OSError, ValueError):
+            self.search_documents = SearchDocuments.validate_json(self.search_documents_path.read_bytes())
+        with contextlib.suppress(OSError, ValueError):
+            self.manifest = Manifest.validate_json(self.manifest_path.read_bytes())
+        for folder in self.frozen_folders:
+            # the contents of frozen folders are unknown, so their covers are the ones chosen by the last build
+            metadata_path = FolderCoverHandler.cover_metadata_path(self.db.targets.get(folder.cover_target, ""))
+            if metadata_path is None:
+                raise ValueError(f"{folder.source.path} has not been built yet, build the whole album first")
+            path = metadata_path.with_suffix("").with_suffix("")
+            # the source of a frozen cover isn't used, only its target files are
+            source = SourceImage(folder.source.path / path.relative_to(folder.path))
+            folder.__dict__["cover_image"] = TargetImage(source, folder, path)
+
+    @property
+    def internal_paths(self) -> list[Path]:
+        """The files of the build itself, which may be in the target folder, but aren't part of the album."""
+        return [
+            self.db_path,
+            self.source_index_path,
+            self.search_documents_path,
+            self.manifest_path,
+            self.manifest_diff_path,
+        ]
+
+    def is_frozen(self, target: Target) -> bool:
+        """Whether the target is in a folder left unscanned by a partial build, see `FrozenHandler`."""
+        path = Path(target.removeprefix("//cover/"))
+        return any(parent in self.frozen_paths for parent in [path, *path.parents])
+
+    def is_compressible(self, target: Target) -> bool:
+        path = Path(target)
+        if target in self.static_files or self.page_of_chunk(target):
+            return True
+        return path.name == "index.html" and self.target_root.path_to_folder(path.parent) is not None
+
+    def page_of_chunk(self, target: Target) -> Optional[Target]:
+        """The `index.html` page that writes `target` if it's one of its `index.N.json` chunks."""
+        path = Path(target)
+        if not (path.name.startswith("index.") and path.suffix == ".json"):
+            return None
+        folder = self.target_root.path_to_folder(path.parent)
+        return str(folder.path / "index.html") if folder and path in folder.chunk_paths() else None
+
+    def compressed_targets(self, target: Target) -> list[Target]:
+        return [f"{target}{suffix}" for suffix in COMPRESSED_SUFFIXES]
+
+    def page_targets(self, folder: TargetFolder) -> list[Target]:
+        """The `index.html` page of a folder, and the precompressed variants of it and of its chunks."""
+        index_html = str(folder.path / "index.html")
+        chunks = [str(path) for path in folder.chunk_paths()]
+        return [index_html, *(target for file in [index_html, *chunks] for target in self.compressed_targets(file))]
+
+    async def get_exif_tags(self, image_path: Path) -> dict[str, Any]:
+        """Reads the EXIF tags of an image using `self.executor` if set (with an exiftool in each worker)."""
+        if self.executor is None:
+            return get_exif_tags(image_path)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, get_exif_tags, image_path)
+
+    async def get_image_placeholder(self, image_path: Path) -> str:
+        """Decodes the placeholder of an image using `self.executor` (the default one if not set), like its renditions."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, image_placeholder, image_path, 16, self.config.max_image_pixels
+        )
+
+    async def render_template(self, name: str, context: dict[str, Any]) -> str:
+        """Renders a template using `self.executor` if set, or in the current thread otherwise."""
+        if self.executor is None:
+            return self.env.get_template(name).render(context)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, render_template, name, context)
+
+    def get_handler(self, target: Target) -> Handler:
+        # the folders don't change during a build, so neither do the handlers of targets, which are costly to find
+        target = str(target)
+        handler = self._target_handlers.get(target)
+        if handler is None:
+            handler = self._target_handlers[target] = super().get_handler(target)
+        return handler
+
+    async def rebuild(self, target: Target, level: int = 0):
+        await super().rebuild(target, level)
+        self._rebuilt_targets.add(str(target))
+
+    async def build(self, target: Target, level: int = 0):
+        target = str(target)
+        if self.is_frozen(target):
+            return
+        await super().build(target, level)
+        if self.progress is not None and target not in self._done_targets:
+            self._done_targets.add(target)
+            handler = self.get_handler(target)
+            rebuilt = target in self._rebuilt_targets
+            written_files = self.written_files(target, handler) if rebuilt else []
+            bytes_written = sum(path.stat().st_size for path in written_files if path.is_file())
+            self.progress.add_done(type(handler).__name__, rebuilt, bytes_written)
+
+    def written_files(self, target: Target, handler: Handler) -> list[Path]:
+        """The files written when `target` was rebuilt, for progress reporting."""
+        if isinstance(handler, TargetImageHandler):
+            return handler.target_image(target).pixel_paths
+        elif isinstance(handler, TargetFolderIndexHandler):
+            return [Path(target), *handler.target_folder(target).chunk_paths()]
+        elif isinstance(handler, FileHandler):
+            return [Path(target)]
+        return []
+
+    def expect_targets(self, progress: BuildProgress):
+        """Counts the targets that `render` builds up front, the ones not counted here are counted as they're found."""
+        folders = list(self.build_root.all_folders())
+        pages = len(folders) + len(self.build_root.parents)
+        chunks = sum(len(folder.chunk_paths()) for folder in [*folders, *self.build_root.parents])
+        images = sum(len(folder.images) for folder in folders)
+        for handler_class, count in [
+            (TargetFolderHandler, len(folders)),
+            (TargetFolderIndexHandler, pages),
+            (StaticFileHandler, len(self.static_files)),
+            (CompressedHandler, (pages + chunks + len(self.static_files)) * len(COMPRESSED_SUFFIXES)),
+            (TargetImageHandler, images),
+            (TargetImageExifHandler, images),
+            (TargetImageMetadataHandler, images),
+        ]:
+            progress.expect(handler_class.__name__, count)
 
     async def render(self):
+        if self.progress is not None:
+            self.expect_targets(self.progress)
         await self.build("//static")
-        await self.build(str(self.target_root.path))
+        await self.build("//sources")
+        await self.build(str(self.build_root.path))
+        # the pages of the ancestors link to the built folder (and to its cover)
+        await asyncio.gather(
+            *(self.build(target) for parent in self.build_root.parents for target in self.page_targets(parent))
+        )
+        await self.build("//search")
+        await self.build("//manifest")
         await self.save_build_db()
 
-
-async def main():
-    global exiftool
-    exiftool = ExifToolHelper().__enter__()
-
-    logging.getLogger().setLevel(logging.INFO)
-    logging.getLogger().addHandler(logging.StreamHandler())
-    parser = argparse.ArgumentParser()
-    parser.add_argument("album_config_path", type=Path)
-    args = parser.parse_args()
-    album_config_path: Path = args.album_config_path
+    def publish(self, destination: Path) -> ManifestDiff:
+        """
+        Copies the files of the album that changed since they were last published to `destination`,
+        and deletes the ones that were removed since.
+
+        Like an object store, `destination` isn't listed: its files are known from the manifest published with them.
+        """
+        root = self.target_root.path
+        published_manifest_path = destination / PUBLISHED_MANIFEST_NAME
+        published_manifest: dict[str, ManifestEntry] = {}
+        with contextlib.suppress(OSError, ValueError):
+            published_manifest = Manifest.validate_json(published_manifest_path.read_bytes())
+
+        diff = ManifestDiff.between(published_manifest, self.manifest)
+        # pages last, so that they don't link to files not published yet
+        for key in sorted(diff.added + diff.changed, key=lambda key: Path(key).name.startswith("index.")):
+            (destination / key).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(root / key, destination / key)
+        for key in diff.removed:
+            (destination / key).unlink(missing_ok=True)
+            for parent in (destination / key).relative_to(destination).parents[:-1]:
+                with contextlib.suppress(OSError):  # not empty
+                    (destination / parent).rmdir()
+
+        destination.mkdir(parents=True, exist_ok=True)
+        write_if_changed(published_manifest_path, Manifest.dump_json(self.manifest, indent=2))
+        logger.info(f"published {root} to {destination}: {diff}")
+        return diff
+
+
+def album_config_files(paths: list[Path]) -> list[Path]:
+    """The album config files at `paths`, where folders stand for the `*.toml` files in them."""
+    return [file for path in paths for file in (sorted(path.glob("*.toml")) if path.is_dir() else [path])]
+
+
+def load_album_config(album_config_path: Path) -> AlbumConfig:
     with open(album_config_path, "rb") as album_config_file:
         album_config_dict = tomllib.load(album_config_file)
+    return AlbumConfig(**album_config_dict)
 
-    album_config = AlbumConfig(**album_config_dict)
 
-    album = Album(album_config.target / "build.db.json", album_config)
-    await album.init()
-    await album.render()
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "album_config_paths",
+        type=Path,
+        nargs="+",
+        metavar="album_config_path",
+        help="album config file, or a folder of them (*.toml), the albums are rendered together",
+    )
+    parser.add_argument(
+        "--only",
+        type=Path,
+        metavar="SUBFOLDER",
+        help="only build this subfolder of the album's source (and its ancestors' pages), e.g. a new event",
+    )
+    parser.add_argument(
+        "--publish",
+        action="store_true",
+        help="copy the changes of the albums to their `publish` folder after rendering",
+    )
+    parser.add_argument("--verbose", "-v", action="store_true", help="log each target that is built")
+    args = parser.parse_args()
 
-    exiftool.__exit__(None, None, None)
+    # progress is displayed in terminals, and reported as JSON lines otherwise
+    console = rich.console.Console(stderr=True)
+    log_handler = rich.logging.RichHandler(console=console) if console.is_terminal else logging.StreamHandler()
+    logging.getLogger().setLevel(logging.INFO)
+    logging.getLogger().addHandler(log_handler)
+    logging.getLogger("boldi.build").setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    album_configs = [load_album_config(path) for path in album_config_files(args.album_config_paths)]
+    if args.only and len(album_configs) != 1:
+        parser.error("--only needs a single album")
+    if args.publish and any(album_config.publish is None for album_config in album_configs):
+        parser.error("--publish needs a `publish` folder in the album configs")
+
+    # the albums share the worker processes (with their exiftool and Jinja environment), and the event loop,
+    # so one album's images are processed while another waits for its pages
+    env = create_jinja_env()
+    progress = BuildProgress()
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        albums = [
+            Album(album_config.target / "build.db.json", album_config, executor, args.only, env, progress)
+            for album_config in album_configs
+        ]
+        await asyncio.gather(*(album.init() for album in albums))
+        progress_reporter = asyncio.create_task(report_progress(progress, console))
+        try:
+            await asyncio.gather(*(album.render() for album in albums))
+        finally:
+            progress_reporter.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await progress_reporter
+
+    if args.publish:
+        await asyncio.gather(
+            *(
+                asyncio.to_thread(album.publish, album.config.publish)  # type: ignore[arg-type] # checked above
+                for album in albums
+            )
+        )
 
 
 if __name__ == "__main__":
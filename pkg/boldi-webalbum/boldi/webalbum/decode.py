@@ -0,0 +1,67 @@
+"""
+Decoding of source images with bounded memory.
+
+Images are decoded already reduced to (at least) the size they're needed at where the format allows it, and only if
+they have at most a given number of pixels once reduced:
+
+- JPEGs are reduced by the decoder itself (by 1/2, 1/4 or 1/8, see `Image.Image.draft`), so even huge panoramas
+  are decoded at a fraction of their size.
+- Other images (PNGs and GIFs are single compressed streams, which can't be decoded in parts) are decoded whole.
+
+The limit replaces Pillow's decompression bomb check (`Image.MAX_IMAGE_PIXELS`), which would apply to the full size
+of JPEGs too, and is set per call rather than process-wide.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+from PIL import GifImagePlugin, Image, ImageFile, JpegImagePlugin, PngImagePlugin, UnidentifiedImageError
+
+MAX_IMAGE_PIXELS = 2 * (1024 * 1024 * 1024 // 4 // 3)
+"""
+The most pixels an image is decoded with, about 540 MB for RGB images and 720 MB with an alpha channel.
+
+The same as the limit above which `Image.open` refuses to open images, twice its default `Image.MAX_IMAGE_PIXELS`.
+"""
+IMAGE_FILES: tuple[type[ImageFile.ImageFile], ...] = (
+    JpegImagePlugin.JpegImageFile,
+    PngImagePlugin.PngImageFile,
+    GifImagePlugin.GifImageFile,
+)
+"""The formats of source images (see `IMAGE_EXTENSIONS`), opened without `Image.open` and its global limit."""
+
+
+def open_image(path: Path) -> ImageFile.ImageFile:
+    """Opens an image (in any of `IMAGE_FILES`) without decoding it, identified by its contents like `Image.open`."""
+    for image_file in IMAGE_FILES:
+        try:
+            return image_file(path)
+        except SyntaxError:  # not of this format
+            continue
+    raise UnidentifiedImageError(f"cannot identify image file {str(path)!r}")
+
+
+def decode_image(
+    path: Path, min_size: tuple[int, int], max_image_pixels: int = MAX_IMAGE_PIXELS, mode: str | None = None
+) -> tuple[Image.Image, tuple[int, int]]:
+    """
+    Decodes an image reduced to a size of at least `min_size` (if it's larger than that and its format allows it).
+
+    Returns the decoded image (in `mode` if possible) and the size of the source image. Raises
+    `Image.DecompressionBombError` if the image would be decoded with more than `max_image_pixels` pixels.
+    """
+    pil_image = open_image(path)
+    source_size = pil_image.size
+    if pil_image.format == "JPEG":
+        pil_image.draft(mode, (max(min_size[0], 1), max(min_size[1], 1)))
+
+    width, height = pil_image.size
+    if width * height > max_image_pixels:
+        pil_image.close()
+        raise Image.DecompressionBombError(
+            f"{path}: decoding it at {width}x{height} exceeds the limit of {max_image_pixels} pixels"
+            " (see `max_image_pixels`)"
+        )
+    pil_image.load()
+    return pil_image, source_size
@@ -0,0 +1,152 @@
+"""
+Justified layout of thumbnails: rows of equal height that exactly fill the width of the page.
+
+Row breaks are computed when the album is built, for each of the `BREAKPOINTS` of the page's width,
+so that browsers only have to size the tiles of each row, instead of flowing them into rows themselves.
+"""
+
+from __future__ import annotations
+
+import math
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+
+@dataclass(frozen=True)
+class Breakpoint:
+    min_width: int
+    """The page (viewport) width in CSS pixels from which this breakpoint applies. Keep in sync with `style.css`."""
+    width: float
+    """The container width the rows are computed for. Rows scale with the actual width of the container."""
+    row_height: float
+    """The preferred height of the rows at `width`."""
+
+
+BREAKPOINTS = (
+    Breakpoint(min_width=0, width=400, row_height=110),
+    Breakpoint(min_width=500, width=800, row_height=140),
+    Breakpoint(min_width=1000, width=1400, row_height=225),
+)
+GAP = 8
+"""The gap between the tiles in CSS pixels (`0.5em` in `style.css`)."""
+
+
+@dataclass(frozen=True)
+class JustifiedLayout:
+    """The justified layout of tiles in a container of `width`, with `gap` between tiles and between rows."""
+
+    width: float
+    gap: float
+    row_ends: npt.NDArray[np.intp]
+    """The index after the last tile of each row, the last one is the number of tiles."""
+    row_heights: npt.NDArray[np.float64]
+    tile_widths: npt.NDArray[np.float64]
+    last_row_slack: float
+    """The width left empty at the end of the last row (which isn't stretched to fill the row), in row heights."""
+
+    @property
+    def row_starts(self) -> npt.NDArray[np.intp]:
+        return np.concatenate(([0], self.row_ends))[:-1].astype(np.intp)
+
+    @property
+    def tile_rows(self) -> npt.NDArray[np.intp]:
+        """The row index of each tile."""
+        return np.repeat(np.arange(len(self.row_ends)), self.row_ends - self.row_starts)
+
+    @property
+    def tile_heights(self) -> npt.NDArray[np.float64]:
+        return self.row_heights[self.tile_rows]
+
+    @property
+    def tile_xs(self) -> npt.NDArray[np.float64]:
+        ends = np.cumsum(self.tile_widths + self.gap)
+        starts_of_rows = np.concatenate(([0.0], ends[self.row_ends[:-1] - 1]))
+        return ends - self.tile_widths - self.gap - starts_of_rows[self.tile_rows]
+
+    @property
+    def tile_ys(self) -> npt.NDArray[np.float64]:
+        row_ys = np.concatenate(([0.0], np.cumsum(self.row_heights + self.gap)[:-1]))
+        return row_ys[self.tile_rows]
+
+    @property
+    def height(self) -> float:
+        return float(self.row_heights.sum() + self.gap * max(len(self.row_heights) - 1, 0))
+
+
+def justify(
+    aspect_ratios: Sequence[float] | npt.ArrayLike, width: float, row_height: float, gap: float = 0
+) -> JustifiedLayout:
+    """
+    Break tiles with the given aspect ratios (width / height) into rows that are justified to `width`.
+
+    Each row is filled greedily at `row_height`, and then the row is either ended before the first tile that doesn't fit
+    (making the row taller) or after it (making the row shorter), whichever height is closer to `row_height`.
+    The last row keeps `row_height` unless it's too wide for that.
+    """
+    aspects = np.asarray(aspect_ratios, dtype=np.float64)
+    count = len(aspects)
+    if count == 0:
+        empty = np.empty(0)
+        return JustifiedLayout(width, gap, empty.astype(np.intp), empty, empty, width / row_height)
+
+    # aspect_sums[i] is the sum of the first i aspect ratios, so the width of tiles i..j-1 at height h is:
+    #     h * (aspect_sums[j] - aspect_sums[i]) + gap * (j - i - 1)
+    aspect_sums = np.concatenate(([0.0], np.cumsum(aspects)))
+    # the same at the preferred row height, with a gap after each tile
+    preferred_ends = aspect_sums[1:] * row_height + gap * np.arange(1, count + 1)
+
+    def height_of(start: int, end: int) -> float:
+        return (width - gap * (end - start - 1)) / (aspect_sums[end] - aspect_sums[start])
+
+    row_ends = []
+    start = 0
+    while start < count:
+        offset = preferred_ends[start - 1] if start else 0.0
+        # the number of tiles that fit in the row at the preferred height, but at least 1
+        end = max(int(preferred_ends.searchsorted(offset + width + gap, side="right")), start + 1)
+        if end < count and abs(math.log(height_of(start, end + 1) / row_height)) < abs(
+            math.log(height_of(start, end) / row_height)
+        ):
+            end += 1
+        row_ends.append(end)
+        start = end
+
+    ends = np.array(row_ends, dtype=np.intp)
+    starts = np.concatenate(([0], ends[:-1]))
+    row_heights = (width - gap * (ends - starts - 1)) / (aspect_sums[ends] - aspect_sums[starts])
+    row_heights[-1] = min(row_heights[-1], row_height)
+    tile_widths = aspects * np.repeat(row_heights, ends - starts)
+    last_row_width = tile_widths[starts[-1] :].sum() + gap * (ends[-1] - starts[-1] - 1)
+    last_row_slack = max(width - last_row_width, 0.0) / row_heights[-1]
+    return JustifiedLayout(width, gap, ends, row_heights, tile_widths, float(last_row_slack))
+
+
+@dataclass(frozen=True)
+class ResponsiveLayout:
+    """
+    The justified layouts of the same tiles at each breakpoint, in the form needed by the templates.
+
+    The tiles themselves are sized by the browser: in each row, flex-grow is their aspect ratio on a zero flex-basis.
+    """
+
+    breaks: list[list[int]]
+    """For each tile, the indexes of the breakpoints at which a row ends after the tile."""
+    slacks: list[float]
+    """For each breakpoint, the `JustifiedLayout.last_row_slack` of its layout."""
+
+
+def responsive_layout(
+    aspect_ratios: Sequence[float], breakpoints: Sequence[Breakpoint] = BREAKPOINTS, gap: float = GAP
+) -> ResponsiveLayout:
+    breaks: list[list[int]] = [[] for _ in aspect_ratios]
+    slacks = []
+    for i, breakpoint in enumerate(breakpoints):
+        layout = justify(aspect_ratios, breakpoint.width, breakpoint.row_height, gap)
+        # the end of the last row is the end of the container, it doesn't need a break
+        for end in layout.row_ends[:-1]:
+            breaks[end - 1].append(i)
+        slacks.append(round(layout.last_row_slack, 2))
+    return ResponsiveLayout(breaks, slacks)
@@ -1,18 +1,79 @@
+"""
+Benchmark and visual test bed of the justified layout engine in `boldi.webalbum.layout`.
+
+Render random tiles laid out at each breakpoint, both by the engine and by the browser using the album's CSS:
+
+    python -m boldi.webalbum.masonry --output masonry.html
+
+Measure the engine:
+
+    python -m boldi.webalbum.masonry --benchmark --count 100000
+"""
+
 import argparse
+import timeit
+from functools import partial
 from pathlib import Path
 
 import jinja2
+import numpy as np
+import numpy.typing as npt
+
+from boldi.webalbum.layout import BREAKPOINTS, GAP, justify, responsive_layout
 
 HERE = Path(__file__).parent.resolve()
+SIZES = [150, 180, 200, 210, 220, 240, 280]
+
+
+def random_aspect_ratios(count: int, seed: int) -> npt.NDArray[np.float64]:
+    rng = np.random.default_rng(seed)
+    return rng.choice(SIZES, count) / rng.choice(SIZES, count)
+
+
+def benchmark(count: int, seed: int, repeat: int = 5):
+    aspect_ratios = random_aspect_ratios(count, seed)
+
+    def report(name: str, timer: timeit.Timer):
+        loops, _ = timer.autorange()
+        best = min(timer.repeat(repeat, loops)) / loops
+        print(f"{name}: {best * 1000:.3f} ms ({best / count * 1e9:.1f} ns/tile)")
+
+    for breakpoint in BREAKPOINTS:
+        timer = timeit.Timer(partial(justify, aspect_ratios, breakpoint.width, breakpoint.row_height, GAP))
+        report(f"justify({count} tiles, width={breakpoint.width})", timer)
+    report(f"responsive_layout({count} tiles)", timeit.Timer(lambda: responsive_layout(list(aspect_ratios))))
+
+
+def render(output: Path, count: int, seed: int):
+    aspect_ratios = random_aspect_ratios(count, seed)
+    layouts = []
+    for breakpoint in BREAKPOINTS:
+        layout = justify(aspect_ratios, breakpoint.width, breakpoint.row_height, GAP)
+        tiles = zip(layout.tile_xs, layout.tile_ys, layout.tile_widths, layout.tile_heights, layout.tile_rows)
+        layouts.append({"breakpoint": breakpoint, "layout": layout, "tiles": list(tiles)})
+
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(HERE / "templates"))
+    context = {
+        "aspect_ratios": aspect_ratios,
+        "layouts": layouts,
+        "responsive": responsive_layout(list(aspect_ratios)),
+        "gap": GAP,
+    }
+    with open(output, "wt") as fp:
+        env.get_template("masonry.html.j2").stream(context).dump(fp)  # type: ignore[arg-type] # https://github.com/pallets/jinja/issues/1983
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--output", "-o", type=Path, default="masonry.html")
+    parser.add_argument("--count", "-n", type=int, default=100, help="number of tiles")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the tiles' aspect ratios")
+    parser.add_argument("--benchmark", action="store_true", help="measure the layout engine instead of rendering")
     args = parser.parse_args()
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(HERE / "templates"))
-    with open(args.output, "wt") as fp:
-        env.get_template("masonry.html.j2").stream().dump(fp)  # type: ignore[arg-type] # https://github.com/pallets/jinja/issues/1983
+    if args.benchmark:
+        benchmark(args.count, args.seed)
+    else:
+        render(args.output, args.count, args.seed)
 
 
 if __name__ == "__main__":
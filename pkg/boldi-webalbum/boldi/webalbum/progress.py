@@ -0,0 +1,155 @@
+"""
+Progress and ETA reporting of album builds.
+
+Shows a `rich` progress display in terminals, and prints periodic JSON lines otherwise (e.g. in CI logs).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import dataclasses
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from rich.console import Console
+from rich.filesize import decimal
+from rich.progress import BarColumn, MofNCompleteColumn, Progress, TaskID, TextColumn, TimeElapsedColumn
+
+
+@dataclass
+class KindProgress:
+    total: int = 0
+    """The number of targets of this kind expected to be built, including the ones that are up to date."""
+    done: int = 0
+    rebuilt: int = 0
+
+
+@dataclass
+class BuildProgress:
+    """Counts the targets of one or more builds by kind (the class of their handler), and the bytes they wrote."""
+
+    image_kind: str = "TargetImageHandler"
+    """The kind of targets counted for images per second."""
+    kinds: collections.defaultdict[str, KindProgress] = field(
+        default_factory=lambda: collections.defaultdict(KindProgress)
+    )
+    bytes_written: int = 0
+    start_time: float = field(default_factory=time.monotonic)
+
+    def expect(self, kind: str, count: int):
+        self.kinds[kind].total += count
+
+    def add_done(self, kind: str, rebuilt: bool, bytes_written: int = 0):
+        kind_progress = self.kinds[kind]
+        kind_progress.done += 1
+        kind_progress.rebuilt += rebuilt
+        # targets not expected up front are counted as they are found
+        kind_progress.total = max(kind_progress.total, kind_progress.done)
+        self.bytes_written += bytes_written
+
+    @property
+    def total(self) -> int:
+        return sum(kind_progress.total for kind_progress in self.kinds.values())
+
+    @property
+    def done(self) -> int:
+        return sum(kind_progress.done for kind_progress in self.kinds.values())
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+    @property
+    def images_per_second(self) -> float:
+        return self.kinds[self.image_kind].rebuilt / max(self.elapsed, 1e-9)
+
+    @property
+    def eta(self) -> float | None:
+        """
+        The estimated seconds until all targets are done, assuming the rest take as long as the ones done.
+
+        Images and the other targets are estimated apart, at their own rates: the others are far more numerous and
+        cheaper (e.g. up to date metadata), and would make the estimate far too optimistic while images remain.
+        """
+        images = self.kinds.get(self.image_kind, KindProgress())
+        eta = 0.0
+        for total, done in [(images.total, images.done), (self.total - images.total, self.done - images.done)]:
+            if total > done:
+                if not done:
+                    return None
+                eta += (total - done) * self.elapsed / done
+        return eta
+
+    def to_json(self) -> dict[str, Any]:
+        eta = self.eta
+        return {
+            "elapsed": round(self.elapsed, 1),
+            "done": self.done,
+            "total": self.total,
+            "images_per_second": round(self.images_per_second, 2),
+            "bytes_written": self.bytes_written,
+            "eta": round(eta, 1) if eta is not None else None,
+            "kinds": {kind: dataclasses.asdict(kind_progress) for kind, kind_progress in sorted(self.kinds.items())},
+        }
+
+    def summary(self) -> str:
+        eta = self.eta
+        return f"{self.images_per_second:.1f} images/s, {decimal(self.bytes_written)} written" + (
+            f", ETA {eta:.0f}s" if eta is not None else ""
+        )
+
+
+async def report_progress(progress: BuildProgress, console: Console, interval: float = 10.0):
+    """
+    Reports `progress` until cancelled, then reports it one last time.
+
+    Uses a live progress display if `console` is a terminal, or prints a JSON line every `interval` seconds otherwise.
+    """
+    if console.is_terminal:
+        await _report_progress_display(progress, console)
+    else:
+        await _report_progress_json(progress, console, interval)
+
+
+async def _report_progress_json(progress: BuildProgress, console: Console, interval: float):
+    def report():
+        print(json.dumps(progress.to_json()), file=console.file, flush=True)
+
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            report()
+    except asyncio.CancelledError:
+        report()
+        raise
+
+
+async def _report_progress_display(progress: BuildProgress, console: Console):
+    columns = (
+        TextColumn("{task.description}"),
+        BarColumn(),
+        MofNCompleteColumn(),
+        TimeElapsedColumn(),
+        TextColumn("{task.fields[summary]}"),
+    )
+    with Progress(*columns, console=console) as display:
+        overall = display.add_task("total", summary="")
+        tasks: dict[str, TaskID] = {}
+
+        def report():
+            for kind, kind_progress in sorted(progress.kinds.items()):
+                if kind not in tasks:
+                    tasks[kind] = display.add_task(kind.removesuffix("Handler"), summary="")
+                display.update(tasks[kind], total=kind_progress.total, completed=kind_progress.done)
+            display.update(overall, total=progress.total, completed=progress.done, summary=progress.summary())
+
+        try:
+            while True:
+                report()
+                await asyncio.sleep(0.2)
+        except asyncio.CancelledError:
+            report()
+            raise
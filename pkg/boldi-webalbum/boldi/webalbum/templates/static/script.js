@@ -171,6 +171,16 @@ function setScrollingTo(element) {
 
 function scrollToNextScrollTarget(delta, source, _) {
     const baseTarget = scrollingTo || source || getCurrentScrollTarget();
+    if (delta > 0 && chunksLoaded < chunks.length && baseTarget === document.querySelector("#images").lastElementChild) {
+        // The next image is in a chunk that isn't loaded yet
+        const loaded = chunksLoaded;
+        loadNextChunk().then(() => {
+            if (chunksLoaded > loaded) {
+                scrollToNextScrollTarget(delta, source, _);
+            }
+        });
+        return;
+    }
     if (!scrollingTo && !isElementPreciselyScrolledIntoView(baseTarget) && delta === 1) {
         delta = 0;
     }
@@ -203,9 +213,13 @@ document.addEventListener("keydown", (event) => {
         event.getModifierState("OS") ||
         event.getModifierState("Super") ||
         event.getModifierState("Meta") ||
-        event.getModifierState("Win")
+        event.getModifierState("Win") ||
+        // Ignore typing in the search box.
+        (event.target instanceof Element && event.target.closest("input, textarea"))
     ) {
         return;
+    } else if (event.key === "/") {
+        document.querySelector("#search input").focus();
     } else if (
         event.key === "ArrowDown"
         || event.key === "PageDown"
@@ -248,6 +262,187 @@ document.addEventListener("keydown", (event) => {
     event.preventDefault();
 });
 
+// Large folders only inline their first images in index.html, and the rest are in index.N.json chunks.
+// Chunks are loaded in order, when the end of the thumbnails or the images scrolls into view,
+// or when a link (or the URL) points to an image in a chunk that isn't loaded yet.
+
+let chunks = [];
+let chunksLoaded = 0;
+let chunkLoading = null;
+let chunkObserver = null;
+
+function setUpChunks() {
+    const images = document.querySelector("#images[data-chunks]");
+    chunks = images ? JSON.parse(images.dataset.chunks) : [];
+    chunksLoaded = 0;
+    chunkLoading = null;
+    if (chunkObserver) {
+        chunkObserver.disconnect();
+    }
+    if (!chunks.length) {
+        return;
+    }
+    chunkObserver = new IntersectionObserver((entries) => {
+        if (entries.some((entry) => entry.isIntersecting)) {
+            loadNextChunk().then(observeChunkSentinels);
+        }
+    }, {rootMargin: "100% 0px"});
+    observeChunkSentinels();
+    scrollToHashInChunks();
+}
+
+function observeChunkSentinels() {
+    // Observing again calls the callback again if a sentinel is still in view after loading a chunk.
+    chunkObserver.disconnect();
+    if (chunksLoaded < chunks.length) {
+        chunkObserver.observe(document.querySelector("#thumbnails").lastElementChild);
+        chunkObserver.observe(document.querySelector("#images").lastElementChild);
+    }
+}
+
+function loadNextChunk() {
+    if (!chunkLoading && chunksLoaded < chunks.length) {
+        const forChunks = chunks;
+        chunkLoading = window.fetch(new URL(chunks[chunksLoaded].url, spaStateUrl))
+            .then((response) => response.json())
+            .then((chunk) => {
+                if (chunks !== forChunks) {
+                    return;  // navigated to another page in the meantime
+                }
+                document.querySelector("#thumbnails").lastElementChild.insertAdjacentHTML("beforebegin", chunk.thumbnails);
+                document.querySelector("#images").insertAdjacentHTML("beforeend", chunk.images);
+                chunksLoaded++;
+            })
+            .finally(() => {
+                chunkLoading = null;
+            });
+    }
+    return chunkLoading || Promise.resolve();
+}
+
+function loadChunksUntil(id) {
+    const stem = id.replace(/_thumbnail$/, "");
+    const index = chunks.findIndex((chunk) => chunk.ids.includes(stem));
+    if (index < chunksLoaded) {
+        return Promise.resolve();
+    }
+    const loaded = chunksLoaded;
+    return loadNextChunk().then(() => chunksLoaded > loaded && loadChunksUntil(id));
+}
+
+function scrollToHashInChunks() {
+    const id = decodeURIComponent(window.location.hash.slice(1));
+    if (id && !document.getElementById(id)) {
+        loadChunksUntil(id).then(() => {
+            const element = document.getElementById(id);
+            if (element) {
+                element.scrollIntoView({behavior: "instant"});
+            }
+        });
+    }
+}
+
+window.addEventListener("hashchange", scrollToHashInChunks);
+
+// The static search index written by the album's SearchIndexHandler is sharded by the first characters of its terms.
+// Each term of the query is looked up in the shard of its prefix, and matches the indexed terms starting with it.
+
+const SEARCH_SHARD_PREFIX_LENGTH = 2;
+const SEARCH_MAX_RESULTS = 100;
+
+const searchShards = new Map();
+let searchQuery = "";
+
+function searchTerms(query) {
+    // Approximates unidecode in ImageMetadata.search_terms, which also strips the accents of letters.
+    return query.normalize("NFKD").replace(/[\u0300-\u036f]/g, "").toLowerCase().match(/[a-z0-9]{2,}/g) || [];
+}
+
+function loadSearchShard(root, prefix) {
+    const url = new URL(`${root}search/${prefix}.json`, spaStateUrl).href;
+    if (!searchShards.has(url)) {
+        const emptyShard = {terms: {}, titles: {}};
+        searchShards.set(url, window.fetch(url)
+            .then((response) => response.ok ? response.json() : emptyShard)
+            .catch(() => {
+                searchShards.delete(url);
+                return emptyShard;
+            }));
+    }
+    return searchShards.get(url);
+}
+
+async function search(root, query) {
+    const terms = [...new Set(searchTerms(query))];
+    const shards = await Promise.all(terms.map((term) => loadSearchShard(root, term.slice(0, SEARCH_SHARD_PREFIX_LENGTH))));
+    let results = null;
+    const titles = {};
+    terms.forEach((term, i) => {
+        const matches = new Set();
+        for (const [indexedTerm, keys] of Object.entries(shards[i].terms)) {
+            if (indexedTerm.startsWith(term)) {
+                keys.forEach((key) => matches.add(key));
+            }
+        }
+        Object.assign(titles, shards[i].titles);
+        results = results === null ? matches : new Set([...results].filter((key) => matches.has(key)));
+    });
+    return [...(results || [])].sort().map((key) => ({key, title: titles[key]}));
+}
+
+function searchResultElement(root, key, title) {
+    // key is the path of the image relative to the album root, see SearchIndexHandler.
+    const folder = key.slice(0, key.lastIndexOf("/") + 1);
+    const name = key.slice(folder.length);
+    const stem = name.slice(0, name.lastIndexOf("."));
+    const suffix = name.slice(stem.length);
+
+    const link = document.createElement("a");
+    link.href = `${root}${folder}index.html#${stem}`;
+    const thumbnail = document.createElement("img");
+    thumbnail.src = `${root}${folder}${stem}.800${suffix}`;
+    thumbnail.alt = title;
+    thumbnail.loading = "lazy";
+    const caption = document.createElement("span");
+    caption.textContent = title;
+    link.append(thumbnail, caption);
+    return link;
+}
+
+async function updateSearchResults(input) {
+    const root = input.closest("#search").dataset.root;
+    const query = input.value;
+    searchQuery = query;
+    const results = await search(root, query);
+    if (query !== searchQuery) {
+        return;  // the query changed in the meantime
+    }
+
+    const container = document.querySelector("#search-results");
+    container.hidden = !searchTerms(query).length;
+    const summary = document.createElement("p");
+    summary.textContent = results.length > SEARCH_MAX_RESULTS
+        ? `${results.length} results, showing the first ${SEARCH_MAX_RESULTS}`
+        : `${results.length} result${results.length === 1 ? "" : "s"}`;
+    container.replaceChildren(summary, ...results.slice(0, SEARCH_MAX_RESULTS).map(({key, title}) => searchResultElement(root, key, title)));
+}
+
+document.addEventListener("input", (event) => {
+    if (event.target.matches("#search input")) {
+        updateSearchResults(event.target);
+    }
+});
+
+document.addEventListener("submit", (event) => {
+    if (event.target.matches("#search")) {
+        event.preventDefault();
+        const firstResult = document.querySelector("#search-results a");
+        if (firstResult) {
+            firstResult.click();
+        }
+    }
+});
+
 function handleLinksInSPA() {
     links = document.querySelectorAll('a[href]:not([href^="#"]):not([href^="javascript:"])');
     for (const link of links) {
@@ -291,12 +486,14 @@ function loadLocationInSPA(href) {
         document.head.replaceWith(page.head);
         document.body.replaceWith(page.body);
         handleLinksInSPA();
+        setUpChunks();
 
         (document.querySelector(new URL(href).hash || "*") || document.documentElement).scrollIntoView();
     });
 }
 
 window.addEventListener("load", handleLinksInSPA);
+window.addEventListener("load", setUpChunks);
 window.addEventListener("load", (event) => {
     spaStateUrl = window.location.href;
     window.history.replaceState({url: spaStateUrl}, null, spaStateUrl);
@@ -0,0 +1,27 @@
+import pytest
+from PIL import Image
+
+from boldi.webalbum.decode import decode_image
+
+
+def test_decode_image_limits_pixels_of_reduced_jpegs(tmp_path):
+    path = tmp_path / "panorama.jpg"
+    Image.new("RGB", (1600, 400)).save(path)
+
+    pil_image, source_size = decode_image(path, (200, 0), max_image_pixels=20_000)
+
+    assert source_size == (1600, 400)
+    assert pil_image.size == (200, 50)  # reduced by the decoder to 1/8
+
+
+def test_decode_image_limits_pixels_of_other_images(tmp_path):
+    path = tmp_path / "panorama.png"
+    Image.new("RGB", (1600, 400)).save(path)
+    max_image_pixels = Image.MAX_IMAGE_PIXELS
+
+    with pytest.raises(Image.DecompressionBombError):
+        decode_image(path, (200, 0), max_image_pixels=20_000)
+    pil_image, _ = decode_image(path, (200, 0), max_image_pixels=640_000)
+
+    assert pil_image.size == (1600, 400)
+    assert Image.MAX_IMAGE_PIXELS == max_image_pixels
@@ -0,0 +1,20 @@
+import time
+
+import pytest
+
+from boldi.webalbum.progress import BuildProgress
+
+
+def test_build_progress_eta_estimates_images_at_their_own_rate():
+    progress = BuildProgress()
+    progress.expect("TargetImageHandler", 10)
+    progress.expect("TargetImageMetadataHandler", 100)
+    for _ in range(90):
+        progress.add_done("TargetImageMetadataHandler", rebuilt=False)
+    assert progress.eta is None  # no image done yet
+
+    progress.add_done("TargetImageHandler", rebuilt=True)
+    progress.start_time = time.monotonic() - 10.0
+
+    # 9 images at 10 s each, and 10 other targets at 10 s per 90
+    assert progress.eta == pytest.approx(9 * 10.0 + 10 * 10.0 / 90, rel=0.01)
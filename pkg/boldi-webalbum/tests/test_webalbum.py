@@ -0,0 +1,90 @@
+import asyncio
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from PIL import Image
+
+from boldi import webalbum
+
+# mypy resolves `boldi.webalbum` to the folder of its submodules instead of `webalbum.py`
+from boldi.webalbum import ImageMetadata  # type: ignore[attr-defined]
+
+
+def test_image_metadata_from_exif_without_iptc_and_xmp():
+    # as exiftool reports an image straight from the camera: without IPTC and XMP tags
+    exif = {
+        "SourceFile": "IMG_0001.jpg",
+        "File": {"ImageWidth": 6000, "ImageHeight": 4000},
+        "EXIF": {"Make": "BOLDI", "Model": "Camera", "ISO": 100},
+        "Composite": {"DateTimeOriginal": "2024:05:01 12:00:00"},
+    }
+
+    metadata = ImageMetadata.from_exif(exif, default_title="IMG_0001")
+
+    assert metadata.title == "IMG_0001"
+    assert metadata.description == ""
+    assert metadata.rating == 0
+    assert (metadata.width, metadata.height) == (6000, 4000)
+    assert metadata.iso == 100
+    assert metadata.created_datetime is not None and metadata.created_datetime.year == 2024
+
+
+def fake_exif_tags(image_path: Path) -> dict[str, Any]:
+    with Image.open(image_path) as pil_image:
+        width, height = pil_image.size
+    return {"SourceFile": str(image_path), "File": {"ImageWidth": width, "ImageHeight": height}}
+
+
+def add_folder(path: Path):
+    path.mkdir(parents=True)
+    Image.new("RGB", (60, 40), (len(path.name) * 40 % 256, 80, 120)).save(path / "IMG_0001.jpg")
+
+
+def render_album(source: Path, target: Path, **config_fields: Any):
+    config = webalbum.AlbumConfig(title="Album", copyright="Boldi", source=source, target=target, **config_fields)
+    album = webalbum.Album(target / "build.db.json", config)
+    asyncio.run(album.init())
+    asyncio.run(album.render())
+
+
+def next_folder_link(page: Path) -> str:
+    # the link of the grid area of the next folder, up to the one of the parent
+    html = page.read_text()
+    return html[html.index("grid-area: 2 / 3 / 4 / 4;") : html.index("grid-area: 1 / 2 / 2 / 3;")]
+
+
+def test_render_relinks_the_neighbours_of_an_inserted_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(webalbum, "get_exif_tags", fake_exif_tags)
+    source, target = tmp_path / "source", tmp_path / "target"
+    add_folder(source / "2021" / "D" / "E")
+    add_folder(source / "2021" / "F")
+    render_album(source, target)
+    assert "F/index.html" in next_folder_link(target / "2021" / "D" / "E" / "index.html")
+
+    # neither the source folder of 2021/D/E nor the one of its parent changed
+    add_folder(source / "2021" / "DD")
+    render_album(source, target)
+
+    assert "DD/index.html" in next_folder_link(target / "2021" / "D" / "E" / "index.html")
+
+
+def test_image_metadata_search_terms_have_english_month_names():
+    metadata = ImageMetadata(title="Beach", created_datetime=datetime(2024, 3, 1), width=60, height=40)
+
+    assert "march" in metadata.search_terms()
+    assert "2024" in metadata.search_terms()
+
+
+def test_render_skips_the_resized_versions_of_images_with_too_many_pixels(tmp_path, monkeypatch):
+    monkeypatch.setattr(webalbum, "get_exif_tags", fake_exif_tags)
+    source, target = tmp_path / "source", tmp_path / "target"
+    add_folder(source / "2021")
+    Image.new("RGB", (200, 100)).save(source / "2021" / "IMG_0002.png")
+
+    render_album(source, target, max_image_pixels=10_000)
+
+    assert (target / "2021" / "IMG_0001.800.jpg").exists()
+    assert (target / "2021" / "IMG_0002.png").exists()
+    assert not (target / "2021" / "IMG_0002.800.png").exists()
+    assert "IMG_0002.png" in (target / "2021" / "index.html").read_text()